@@ -1,5 +1,6 @@
 
 from .consts import BIND, CONNECT, PUSH, PULL, PUB, SUB, BASE_DISPATCHER_URL, DEFAULT_DISPATCHER_URL
+from .consts import BLOCK, DROP_OLDEST, DROP_NEWEST, CATCH_UP, SKIP
 from .sender import Sender, sender, Channel
 from .source import Source, source
 
@@ -0,0 +1,188 @@
+import json
+import os
+import time
+from logging import getLogger
+from threading import Lock
+
+import numpy as np
+
+_logger = getLogger(__name__)
+
+
+class BlockSizeCalibration:
+
+    default_block_sizes = (2048, 4096, 8192, 16384, 32768, 65536)
+
+
+    def __init__(self, n_values=10, block_sizes=default_block_sizes, ratio_tolerance=0.02, file_name=None):
+        """
+        Calibrates the bitshuffle compression block size of each compressed array channel of a sender. The first
+        n_values arrays of a channel are compressed with all candidate block sizes and the block size with the
+        highest compression throughput is pinned - among the block sizes reaching the best compression ratio
+        (within ratio_tolerance).
+        :param n_values: Number of values of a channel to calibrate with. The values are still sent (compressed with
+                         the default block size), but each of them is compressed once per candidate block size.
+        :param block_sizes: Candidate block sizes in bytes.
+        :param ratio_tolerance: Relative compression ratio below the best ratio that is still accepted for a faster
+                                block size.
+        :param file_name: JSON file the calibrated block sizes are stored in. Block sizes of channels found in the
+                          file (with the same type, shape and compression) are used without calibrating.
+        """
+        self.n_values = n_values
+        self.block_sizes = tuple(block_sizes)
+        self.ratio_tolerance = ratio_tolerance
+        self.file_name = file_name
+
+        # Channel name -> {"type", "shape", "compression", "block_size"}
+        self.channels = {}
+        # Channel name -> list of {"block_size", "ratio", "mb_s"} measured during the calibration.
+        self.measurements = {}
+
+        self._lock = Lock()
+
+        if file_name is not None and os.path.exists(file_name):
+            with open(file_name) as calibration_file:
+                self.channels = json.load(calibration_file)
+
+
+    def get_block_size(self, metadata):
+        """
+        :param metadata: Channel metadata.
+        :return: Calibrated block size in bytes, None if the channel is not calibrated (or its type, shape or
+                 compression changed since).
+        """
+        with self._lock:
+            calibration = self.channels.get(metadata["name"])
+
+        if calibration is None or any(calibration.get(key) != value
+                                      for key, value in self._get_channel_specs(metadata).items()):
+            return None
+
+        return calibration["block_size"]
+
+
+    def get_encoder(self, metadata, get_encoder):
+        """
+        Get the encoder of a channel - calibrating the block size with the first values if not calibrated yet.
+        :param metadata: Channel metadata.
+        :param get_encoder: Function block_size -> value encoder. block_size None for the default block size.
+        :return: Value encoder.
+        """
+        block_size = self.get_block_size(metadata)
+        if block_size is not None:
+            return get_encoder(block_size)
+
+        return CalibratingEncoder(self, metadata, get_encoder)
+
+
+    def set_block_size(self, metadata, block_size, measurements=None):
+        """
+        Pin the block size of a channel and store it in the file (if any).
+        """
+        with self._lock:
+            self.channels[metadata["name"]] = dict(self._get_channel_specs(metadata), block_size=block_size)
+            if measurements is not None:
+                self.measurements[metadata["name"]] = measurements
+
+            if self.file_name is not None:
+                # Write a temporary file first - an interrupted write does not corrupt the existing calibration.
+                temporary_file_name = self.file_name + ".tmp"
+                with open(temporary_file_name, "w") as calibration_file:
+                    json.dump(self.channels, calibration_file, indent=2)
+                os.replace(temporary_file_name, self.file_name)
+
+
+    def select_block_size(self, measurements):
+        """
+        :param measurements: List of {"block_size", "ratio", "mb_s"}.
+        :return: Fastest block size among the ones with a compression ratio within the tolerance of the best ratio.
+        """
+        best_ratio = max(measurement["ratio"] for measurement in measurements)
+        candidates = [measurement for measurement in measurements
+                      if measurement["ratio"] >= best_ratio * (1 - self.ratio_tolerance)]
+
+        return max(candidates, key=lambda measurement: measurement["mb_s"])["block_size"]
+
+
+    @staticmethod
+    def _get_channel_specs(metadata):
+        # Shapes are compared as lists - tuples become lists in the JSON file.
+        shape = metadata.get("shape")
+
+        return {"type": metadata.get("type"),
+                "shape": list(shape) if shape is not None else None,
+                "compression": metadata.get("compression")}
+
+
+
+class CalibratingEncoder:
+
+    def __init__(self, calibration, metadata, get_encoder):
+        """
+        Encoder measuring the candidate block sizes with the first values of a channel. Once calibrated, the values
+        are encoded with the selected block size.
+        :param calibration: BlockSizeCalibration the result is pinned in.
+        :param metadata: Channel metadata.
+        :param get_encoder: Function block_size -> value encoder.
+        """
+        self.calibration = calibration
+        self.metadata = metadata
+
+        self.encoder = get_encoder(None)
+        self.candidate_encoders = {block_size: get_encoder(block_size) for block_size in calibration.block_sizes}
+
+        self.n_values = 0
+        self.n_bytes = 0
+        self.n_compressed_bytes = dict.fromkeys(self.candidate_encoders, 0)
+        # Best (minimum) time per byte of each block size.
+        self.time_per_byte = dict.fromkeys(self.candidate_encoders, float("inf"))
+
+        self.calibrated = False
+        self._lock = Lock()
+
+
+    def __call__(self, value):
+        # Only non-empty arrays are compressed with the block size.
+        if not self.calibrated and isinstance(value, np.ndarray) and value.size:
+            self._measure(value)
+
+        return self.encoder(value)
+
+
+    def _measure(self, value):
+        # The compression executor might encode several values of the channel at the same time.
+        with self._lock:
+            if self.calibrated:
+                return
+
+            # The order of the block sizes is rotated from value to value - the first one compresses the value
+            # with cold caches.
+            block_sizes = list(self.candidate_encoders)
+            first = self.n_values % len(block_sizes)
+
+            for block_size in block_sizes[first:] + block_sizes[:first]:
+                start_time = time.perf_counter()
+                compressed_bytes = self.candidate_encoders[block_size](value)
+                time_per_byte = (time.perf_counter() - start_time) / value.nbytes
+
+                self.time_per_byte[block_size] = min(self.time_per_byte[block_size], time_per_byte)
+                self.n_compressed_bytes[block_size] += len(compressed_bytes)
+
+            self.n_bytes += value.nbytes
+            self.n_values += 1
+
+            if self.n_values < self.calibration.n_values:
+                return
+
+            measurements = [{"block_size": block_size,
+                             "ratio": self.n_bytes / self.n_compressed_bytes[block_size],
+                             "mb_s": 1e-6 / self.time_per_byte[block_size] if self.time_per_byte[block_size] else
+                             float("inf")}
+                            for block_size in self.candidate_encoders]
+            block_size = self.calibration.select_block_size(measurements)
+
+            self.calibration.set_block_size(self.metadata, block_size, measurements)
+            self.encoder = self.candidate_encoders[block_size]
+            self.calibrated = True
+
+            _logger.info(f"Calibrated block size of channel '{self.metadata['name']}': {block_size} bytes.")
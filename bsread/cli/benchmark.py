@@ -0,0 +1,292 @@
+import csv
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from bsread.data.serialization import compression_provider_mapping
+
+
+default_dtypes = ["uint16", "float32"]
+default_shapes = ["4096", "1024x1024"]
+
+# Entropy profiles of the synthetic arrays.
+profiles = ["zeros", "ramp", "sparse", "noise", "random"]
+
+# Columns of the results (in order). The *_traced_bytes columns are the peak Python/numpy allocations traced by
+# tracemalloc - buffers allocated internally by the compression libraries are not included.
+result_fields = ["compression", "dtype", "shape", "profile", "n_bytes", "compressed_n_bytes", "ratio",
+                 "compress_mb_s", "decompress_mb_s", "decompress_out_mb_s",
+                 "compress_traced_bytes", "decompress_traced_bytes", "decompress_out_traced_bytes"]
+
+
+def parse_shape(shape):
+    """
+    :param shape: Shape string in numpy order (slowest dimension first), e.g. "1024x512".
+    :return: Shape tuple.
+    """
+    return tuple(int(size) for size in shape.lower().split("x"))
+
+
+def get_synthetic_array(dtype, shape, profile, seed=0):
+    """
+    Generate an array with the given entropy profile.
+    :param dtype: Numpy dtype.
+    :param shape: Numpy shape.
+    :param profile: zeros, ramp (smooth gradient), sparse (1% random hits on zeros - detector like), noise (low
+                    amplitude gaussian noise on an offset - camera like) or random (uniform over the value range,
+                    incompressible).
+    :param seed: Seed of the random generator - the same arrays are generated on every run.
+    :return: Array.
+    """
+    if profile not in profiles:
+        raise ValueError(f'Profile "{profile}" not supported. Available: {profiles}')
+
+    dtype = np.dtype(dtype)
+    n_elements = int(np.prod(shape))
+    random = np.random.default_rng(seed)
+
+    # Value range of the dtype - floats are generated in a range of typical measurement values. The range of 64 bit
+    # integers is limited to what float64 represents exactly.
+    if dtype.kind in "iu":
+        minimum, maximum = max(np.iinfo(dtype).min, -2 ** 53), min(np.iinfo(dtype).max, 2 ** 53)
+    else:
+        minimum, maximum = 0.0, 1000.0
+
+    if profile == "zeros":
+        values = np.zeros(n_elements)
+    elif profile == "ramp":
+        values = np.linspace(max(minimum, 0), maximum, n_elements)
+    elif profile == "sparse":
+        values = np.zeros(n_elements)
+        hits = random.random(n_elements) < 0.01
+        values[hits] = random.uniform(max(minimum, 0), maximum, hits.sum())
+    elif profile == "noise":
+        offset = max(minimum, 0) + (maximum - max(minimum, 0)) / 16
+        values = random.normal(offset, 4, n_elements)
+    else:
+        values = random.uniform(minimum, maximum, n_elements)
+
+    if dtype.kind in "iu":
+        values = np.clip(np.round(values), minimum, maximum)
+
+    return values.astype(dtype).reshape(shape)
+
+
+def get_synthetic_arrays(dtypes=None, shapes=None, profile_names=None):
+    """
+    :return: List of (dtype name, shape, profile, array) for all combinations of dtypes, shapes and profiles.
+    """
+    arrays = []
+
+    for dtype in dtypes or default_dtypes:
+        for shape in shapes or default_shapes:
+            shape = parse_shape(shape) if isinstance(shape, str) else tuple(shape)
+
+            for profile in profile_names or profiles:
+                arrays.append((np.dtype(dtype).name, shape, profile, get_synthetic_array(dtype, shape, profile)))
+
+    return arrays
+
+
+def load_arrays(file_names):
+    """
+    Load user supplied arrays (numpy .npy files). The file name (without extension) is used as profile.
+    :return: List of (dtype name, shape, profile, array).
+    """
+    arrays = []
+
+    for file_name in file_names:
+        array = np.ascontiguousarray(np.load(file_name))
+        profile = os.path.splitext(os.path.basename(file_name))[0]
+        arrays.append((array.dtype.name, array.shape, profile, array))
+
+    return arrays
+
+
+def measure_time(function, min_time=0.2, repeat=3):
+    """
+    :return: Best time in seconds of a single call.
+    """
+    timer = timeit.Timer(function)
+
+    # Increase the number of calls per run until a run takes at least min_time.
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / elapsed) + 1) if elapsed > 0 else number * 10
+
+    return min([elapsed] + timer.repeat(repeat - 1, number)) / number
+
+
+def measure_traced_bytes(function):
+    """
+    :return: Peak number of bytes allocated during a call, as traced by tracemalloc - Python and numpy allocations
+             only, not the internal buffers of C libraries.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+
+    try:
+        tracemalloc.clear_traces()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+        function()
+
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def benchmark(array, compression, min_time=0.2, repeat=3):
+    """
+    Benchmark compression and decompression of an array.
+    :param array: Array to compress.
+    :param compression: Compression name (from compression_provider_mapping).
+    :param min_time: Minimum time in seconds of a single timing run.
+    :param repeat: Number of timing runs - the best is reported.
+    :return: Dictionary with the result_fields (without dtype, shape and profile).
+    """
+    provider = compression_provider_mapping[compression]
+
+    dtype = array.dtype.str
+    # bsread shape - fastest dimension first.
+    shape = list(array.shape[::-1])
+
+    compressed = provider.pack_data(array, dtype)
+    compressed_n_bytes = len(compressed)
+
+    # Check the roundtrip before measuring.
+    unpacked = provider.unpack_data(compressed, dtype, shape)
+    if array.size and not np.array_equal(unpacked.reshape(array.shape), array):
+        raise RuntimeError(f"Roundtrip with compression {compression} failed.")
+
+    out = np.empty_like(unpacked) if unpacked is not None else None
+
+    def compress():
+        provider.pack_data(array, dtype)
+
+    def decompress():
+        provider.unpack_data(compressed, dtype, shape)
+
+    def decompress_out():
+        provider.unpack_data(compressed, dtype, shape, out=out)
+
+    n_megabytes = array.nbytes / 1e6
+    compress_time = measure_time(compress, min_time, repeat)
+    decompress_time = measure_time(decompress, min_time, repeat)
+    decompress_out_time = measure_time(decompress_out, min_time, repeat)
+
+    return {"compression": str(compression),
+            "n_bytes": array.nbytes,
+            "compressed_n_bytes": compressed_n_bytes,
+            "ratio": array.nbytes / compressed_n_bytes if compressed_n_bytes else 0.0,
+            "compress_mb_s": n_megabytes / compress_time,
+            "decompress_mb_s": n_megabytes / decompress_time,
+            "decompress_out_mb_s": n_megabytes / decompress_out_time,
+            "compress_traced_bytes": measure_traced_bytes(compress),
+            "decompress_traced_bytes": measure_traced_bytes(decompress),
+            "decompress_out_traced_bytes": measure_traced_bytes(decompress_out)}
+
+
+def run_benchmarks(arrays, compressions=None, min_time=0.2, repeat=3):
+    """
+    Benchmark all arrays with all compressions.
+    :param arrays: List of (dtype name, shape, profile, array) - see get_synthetic_arrays and load_arrays.
+    :param compressions: Compression names - by default all available compressions.
+    :return: List of result dictionaries (result_fields).
+    """
+    if compressions is None:
+        # None and "none" are the same provider.
+        compressions = [compression for compression in compression_provider_mapping if compression is not None]
+
+    for compression in compressions:
+        if compression not in compression_provider_mapping:
+            raise ValueError(f'Compression "{compression}" not available. '
+                             f'Available: {list(compression_provider_mapping.keys())}')
+
+    results = []
+
+    for dtype, shape, profile, array in arrays:
+        for compression in compressions:
+            result = benchmark(array, compression, min_time, repeat)
+            result.update(dtype=dtype, shape="x".join(str(size) for size in shape), profile=profile)
+            results.append({field: result[field] for field in result_fields})
+
+    return results
+
+
+def write_results(results, output_format="table", stream=None):
+    """
+    :param output_format: table (human readable), csv or json.
+    """
+    stream = stream or sys.stdout
+
+    if output_format == "json":
+        json.dump(results, stream, indent=2)
+        stream.write("\n")
+
+    elif output_format == "csv":
+        writer = csv.DictWriter(stream, fieldnames=result_fields)
+        writer.writeheader()
+        writer.writerows(results)
+
+    else:
+        row_format = "{:16.16} {:8.8} {:12.12} {:10.10} {:>7} {:>12} {:>12} {:>12} {:>14}"
+        stream.write(row_format.format("COMPRESSION", "DTYPE", "SHAPE", "PROFILE", "RATIO", "COMP MB/s",
+                                       "DECOMP MB/s", "OUT MB/s", "DECOMP TRACED") + "\n")
+        for result in results:
+            stream.write(row_format.format(result["compression"], result["dtype"], result["shape"],
+                                           result["profile"], f"{result['ratio']:.2f}",
+                                           f"{result['compress_mb_s']:.1f}", f"{result['decompress_mb_s']:.1f}",
+                                           f"{result['decompress_out_mb_s']:.1f}",
+                                           str(result["decompress_traced_bytes"])) + "\n")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the compressions on synthetic and user supplied arrays")
+    parser.add_argument("-c", "--compression", action="append", default=None,
+                        help=f"Compression to benchmark (can be repeated). Default: all available - "
+                             f"{[compression for compression in compression_provider_mapping if compression]}")
+    parser.add_argument("-d", "--dtype", action="append", default=None,
+                        help=f"Dtype of the synthetic arrays (can be repeated). Default: {default_dtypes}")
+    parser.add_argument("-s", "--shape", action="append", default=None,
+                        help=f"Shape of the synthetic arrays, slowest dimension first, e.g. 1024x512 (can be "
+                             f"repeated). Default: {default_shapes}")
+    parser.add_argument("-p", "--profile", action="append", default=None, choices=profiles,
+                        help="Entropy profile of the synthetic arrays (can be repeated). Default: all")
+    parser.add_argument("-f", "--file", action="append", default=[],
+                        help="Numpy (.npy) file with an array to benchmark additionally (can be repeated).")
+    parser.add_argument("--no_synthetic", action="store_true", help="Only benchmark the arrays of the files.")
+    parser.add_argument("--min_time", type=float, default=0.2, help="Minimum time in seconds of a timing run.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timing runs - the best is reported.")
+    parser.add_argument("--format", default="table", choices=["table", "csv", "json"], help="Output format.")
+    parser.add_argument("-o", "--output", default=None, help="Output file. Default: stdout")
+
+    arguments = parser.parse_args()
+
+    arrays = [] if arguments.no_synthetic else get_synthetic_arrays(arguments.dtype, arguments.shape,
+                                                                    arguments.profile)
+    arrays += load_arrays(arguments.file)
+
+    results = run_benchmarks(arrays, arguments.compression, arguments.min_time, arguments.repeat)
+
+    if arguments.output:
+        with open(arguments.output, "w", newline="") as output_file:
+            write_results(results, arguments.format, output_file)
+    else:
+        write_results(results, arguments.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,8 @@ COMMANDS = {
     "create":   "Create a test softioc",
     "simulate": "Provide a test stream",
     "avail":    "Show currently available beam synchronous channels",
-    "status":   "Show status of beam synchronous channels"
+    "status":   "Show status of beam synchronous channels",
+    "benchmark": "Benchmark the data compressions"
 }
 
 HEADER = "Usage: bs COMMAND [OPTIONS]"
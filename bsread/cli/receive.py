@@ -14,7 +14,8 @@ def receive(source=None, clear=False, table="auto", queue_size=100, mode=mflow.P
     print(f"Trying to connect to {source}")
 
     receiver = mflow.connect(source, conn_type="connect", queue_size=queue_size, mode=mode)
-    handler = Handler()
+    # Channels not in the filter are already dropped by the handler, without decoding them.
+    handler = Handler(projection=channel_filter)
 
     receive = lambda: receiver.receive(handler=handler.receive).data
     Table = tables.available[table]
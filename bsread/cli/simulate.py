@@ -1,5 +1,7 @@
 import math
 
+from bsread.consts import CATCH_UP, SKIP
+
 
 def waveform(pulse_id):
     waveform = []
@@ -28,7 +30,7 @@ simulated_channels = [
 ]
 
 
-def generate_stream(port, n_messages=None, interval=0.01):
+def generate_stream(port, n_messages=None, interval=0.01, overrun_policy=CATCH_UP, busy_wait=0.0):
     from bsread import Sender
 
     generator = Sender(port=port)
@@ -36,7 +38,8 @@ def generate_stream(port, n_messages=None, interval=0.01):
     for channel in simulated_channels:
         generator.add_channel(**channel)
 
-    generator.generate_stream(n_messages=n_messages, interval=interval)
+    return generator.generate_stream(n_messages=n_messages, interval=interval, overrun_policy=overrun_policy,
+                                     busy_wait=busy_wait)
 
 
 def main():
@@ -48,10 +51,21 @@ def main():
                                                                            "None means infinity.")
     parser.add_argument("-i", "--interval", type=float, default=0.01, help="Interval in seconds between messages."
                                                                            "Default: 0.01 second.")
+    parser.add_argument("--overrun_policy", default=CATCH_UP, choices=[CATCH_UP, SKIP],
+                        help=f"Behaviour if sending a message takes longer than the interval: send the missed "
+                             f"messages back to back ({CATCH_UP}) or drop them ({SKIP}).")
+    parser.add_argument("--busy_wait", type=float, default=0.0, help="Time in seconds before each message to "
+                                                                     "busy-wait instead of sleeping (less jitter).")
 
     arguments = parser.parse_args()
 
-    generate_stream(port=arguments.port, n_messages=arguments.n_messages, interval=arguments.interval)
+    try:
+        statistics = generate_stream(port=arguments.port, n_messages=arguments.n_messages,
+                                     interval=arguments.interval, overrun_policy=arguments.overrun_policy,
+                                     busy_wait=arguments.busy_wait)
+        print(statistics)
+    except KeyboardInterrupt:
+        pass
 
 
 
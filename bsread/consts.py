@@ -12,5 +12,14 @@ BIND = "bind"
 BASE_DISPATCHER_URL = "https://dispatcher-api.psi.ch"
 DEFAULT_DISPATCHER_URL = BASE_DISPATCHER_URL + "/sf-databuffer"
 
+# Overflow policies of the pipelined sender
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+# Overrun policies of the paced stream generation
+CATCH_UP = "catch_up"
+SKIP = "skip"
+
 
 
@@ -0,0 +1,150 @@
+import weakref
+from collections import defaultdict
+from threading import RLock
+
+import numpy as np
+
+
+class BufferPool:
+
+    def __init__(self, max_free_buffers=4):
+        """
+        Pool of arrays to decompress received values into, keyed by dtype and shape. Arrays are recycled once the
+        message holding them is released (Message.release()). Arrays that are never released are simply garbage
+        collected.
+        :param max_free_buffers: Maximum number of free arrays kept per dtype and shape. Released arrays beyond this
+                                 number are dropped.
+        """
+        self.max_free_buffers = max_free_buffers
+
+        # Counters
+        self.n_allocated = 0  # New arrays allocated.
+        self.n_reused = 0  # Arrays taken from the pool.
+        self.n_released = 0  # Arrays returned to the pool.
+        self.n_dropped = 0  # Released arrays not kept because the pool was full.
+
+        # High-water marks
+        self.max_in_use = 0  # Maximum number of arrays handed out and not released (or collected) yet.
+        self.max_in_use_bytes = 0
+        self.max_free_bytes = 0  # Maximum number of bytes held by free arrays.
+
+        self.in_use_bytes = 0
+        self.free_bytes = 0
+
+        # (dtype, shape) -> list of free arrays.
+        self._free = defaultdict(list)
+        # id(array) -> weak reference of the arrays handed out.
+        self._in_use = {}
+        # Reentrant - the garbage collection callback of an array can run while the lock is held.
+        self._lock = RLock()
+
+
+    def allocate(self, dtype, shape):
+        """
+        Get an array from the pool - or a new one if no array of this dtype and shape is free.
+        Can be used as allocator of the handlers.
+        :param dtype: Numpy dtype of the array.
+        :param shape: Numpy shape of the array.
+        :return: Array (uninitialized).
+        """
+        key = (np.dtype(dtype), tuple(shape))
+
+        with self._lock:
+            free = self._free.get(key)
+
+            if free:
+                array = free.pop()
+                self.n_reused += 1
+                self.free_bytes -= array.nbytes
+            else:
+                array = None
+
+        new_array = array is None
+        if new_array:
+            array = np.empty(key[1], dtype=key[0])
+
+        with self._lock:
+            if new_array:
+                self.n_allocated += 1
+
+            self._in_use[id(array)] = weakref.ref(array, self._get_collect_callback(id(array), array.nbytes))
+            self.in_use_bytes += array.nbytes
+            self.max_in_use = max(self.max_in_use, len(self._in_use))
+            self.max_in_use_bytes = max(self.max_in_use_bytes, self.in_use_bytes)
+
+        return array
+
+
+    def release(self, array):
+        """
+        Return an array to the pool. The array must not be used anymore afterwards.
+        :param array: Array returned by allocate.
+        :return: True if the array belongs to the pool, False otherwise (the array is ignored).
+        """
+        with self._lock:
+            reference = self._in_use.get(id(array))
+
+            if reference is None or reference() is not array:
+                return False
+
+            del self._in_use[id(array)]
+            self.in_use_bytes -= array.nbytes
+            self.n_released += 1
+
+            free = self._free[(array.dtype, array.shape)]
+
+            if len(free) >= self.max_free_buffers:
+                self.n_dropped += 1
+                return True
+
+            free.append(array)
+            self.free_bytes += array.nbytes
+            self.max_free_bytes = max(self.max_free_bytes, self.free_bytes)
+
+        return True
+
+
+    def clear(self):
+        """
+        Drop all free arrays.
+        """
+        with self._lock:
+            self._free.clear()
+            self.free_bytes = 0
+
+
+    @property
+    def n_in_use(self):
+        return len(self._in_use)
+
+
+    @property
+    def statistics(self):
+        with self._lock:
+            return {"allocated": self.n_allocated,
+                    "reused": self.n_reused,
+                    "released": self.n_released,
+                    "dropped": self.n_dropped,
+                    "in_use": len(self._in_use),
+                    "in_use_bytes": self.in_use_bytes,
+                    "free_bytes": self.free_bytes,
+                    "max_in_use": self.max_in_use,
+                    "max_in_use_bytes": self.max_in_use_bytes,
+                    "max_free_bytes": self.max_free_bytes}
+
+
+    def _get_collect_callback(self, array_id, n_bytes):
+        pool_reference = weakref.ref(self)
+
+        # Arrays that are not released but garbage collected are not in use anymore.
+        def collect(reference):
+            pool = pool_reference()
+            if pool is None:
+                return
+
+            with pool._lock:
+                if pool._in_use.get(array_id) is reference:
+                    del pool._in_use[array_id]
+                    pool.in_use_bytes -= n_bytes
+
+        return collect
@@ -1,3 +1,4 @@
+import ctypes
 import struct
 import numpy as np
 from logging import getLogger
@@ -14,15 +15,103 @@ try:
 except:
     _logger.warning("LZ4 not installed")
 
+# Optional - the compression providers using these libraries are disabled if they are not available.
+try:
+    # Only available if bitshuffle was built with zstd support.
+    from bitshuffle import compress_zstd as bitshuffle_compress_zstd, decompress_zstd as bitshuffle_decompress_zstd
+except ImportError:
+    bitshuffle_compress_zstd = bitshuffle_decompress_zstd = None
+    _logger.debug("Bitshuffle without zstd support - bitshuffle_zstd compression disabled")
+
+try:
+    import blosc2
+except ImportError:
+    blosc2 = None
+    _logger.debug("Blosc2 not installed - blosc2 compression disabled")
+
+
+def _get_native_function(get_module, name, restype, argtypes):
+    """
+    Bind a C function exported by an extension module, to decompress directly into a provided array.
+    ctypes releases the GIL during the call.
+    :param get_module: Function returning the extension module exporting the function.
+    :return: ctypes function, None if not available (decompression then falls back to the Python API).
+    """
+    try:
+        function = getattr(ctypes.CDLL(get_module().__file__), name)
+    except Exception:
+        _logger.debug(f"Native function {name} not available.")
+        return None
+
+    function.restype = restype
+    function.argtypes = argtypes
+    return function
+
+
+# int64_t bshuf_decompress_lz4(const void* in, void* out, size_t size, size_t elem_size, size_t block_size)
+_bshuf_decompress_lz4 = _get_native_function(lambda: bitshuffle.ext, "bshuf_decompress_lz4", ctypes.c_int64,
+                                             [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t,
+                                              ctypes.c_size_t])
+
+# int64_t bshuf_decompress_zstd(const void* in, void* out, size_t size, size_t elem_size, size_t block_size)
+_bshuf_decompress_zstd = _get_native_function(lambda: bitshuffle.ext, "bshuf_decompress_zstd", ctypes.c_int64,
+                                              [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t,
+                                               ctypes.c_size_t]) if bitshuffle_decompress_zstd is not None else None
+
+# int LZ4_decompress_safe(const char* src, char* dst, int compressedSize, int dstCapacity)
+_lz4_decompress_safe = _get_native_function(lambda: lz4.block._block, "LZ4_decompress_safe", ctypes.c_int,
+                                            [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_int])
+
+
+def _get_output_array(out, dtype, shape):
+    """
+    Allocate the output array, or check that the provided one fits.
+    """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+
+    if out.dtype != dtype or out.shape != tuple(shape) or not out.flags.c_contiguous or not out.flags.writeable:
+        raise ValueError(f"Output array with dtype={out.dtype} and shape={out.shape} does not match unpacked data "
+                         f"with dtype={dtype} and shape={tuple(shape)} (or is not contiguous and writeable).")
+
+    return out
+
+
+def get_unpacked_shape_from_size(uncompressed_size, dtype, shape=None):
+    """
+    Get the shape of the unpacked data from its uncompressed size - for compressions storing the size in a header.
+    :param uncompressed_size: Uncompressed size in bytes.
+    :param dtype: dtype of the unpacked data.
+    :param shape: Shape of the channel (bsread order, fastest dimension first).
+    :return: Numpy shape (slowest dimension first), None if the size is 0.
+    """
+    n_bytes_per_element = np.dtype(dtype).itemsize
+    if uncompressed_size % n_bytes_per_element != 0:
+        raise ValueError("Invalid uncompressed size or dtype for raw bytes.")
+
+    n_elements = uncompressed_size // n_bytes_per_element
+    if n_elements == 0:
+        return None
+
+    # Do not reshape scalars
+    if shape is not None and shape != [1]:
+        # Numpy is slowest dimension first, but bsread is fastest dimension first
+        return tuple(shape[::-1])
+
+    return (n_elements,)
+
+
 class NoCompression:
 
     @staticmethod
-    def unpack_data(raw_string, dtype, shape=None):
+    def unpack_data(raw_string, dtype, shape=None, out=None):
         """
         Convert raw bytes into the specified numpy type.
         :param raw_string: Raw bytes to convert.
         :param dtype: dtype to use for the result.
         :param shape: Shape of the result.
+        :param out: Array (of the shape returned by get_unpacked_shape) to copy the data into. By default the
+                    result is a view of the raw bytes.
         :return: Numpy array of dtype and shape.
         """
         raw_data = np.frombuffer(raw_string, dtype=dtype)
@@ -36,8 +125,31 @@ class NoCompression:
             # Numpy is slowest dimension first, but bsread is fastest dimension first.
             raw_data = raw_data.reshape(shape[::-1])
 
+        if out is not None:
+            out = _get_output_array(out, raw_data.dtype, raw_data.shape)
+            out[...] = raw_data
+            return out
+
         return raw_data
 
+    @staticmethod
+    def get_unpacked_shape(raw_string, dtype, shape=None):
+        """
+        Get the shape of the array unpack_data returns.
+        :param raw_string: Raw bytes to convert.
+        :param dtype: dtype to use for the result.
+        :param shape: Shape of the result.
+        :return: Numpy shape (slowest dimension first), None if the raw bytes hold no data.
+        """
+        n_elements = len(raw_string) // np.dtype(dtype).itemsize
+        if n_elements == 0:
+            return None
+
+        if shape is not None and shape != [1]:
+            return tuple(shape[::-1])
+
+        return (n_elements,)
+
     @staticmethod
     def pack_data(numpy_array, dtype=None):
         """
@@ -51,12 +163,14 @@ class NoCompression:
 
 class LZ4:
     @staticmethod
-    def unpack_data(raw_bytes, dtype, shape=None):
+    def unpack_data(raw_bytes, dtype, shape=None, out=None):
         """
         Convert raw bytes into the specified numpy type.
         :param raw_bytes: Raw bytes to convert (lz4-compressed).
         :param dtype: dtype to use for the result.
         :param shape: Shape of the result.
+        :param out: Array (of the shape returned by get_unpacked_shape) to decompress into. By default a new array
+                    is allocated.
         :return: Numpy array of dtype and shape.
         """
 
@@ -65,30 +179,60 @@ class LZ4:
             return None
 
         raw_data = np.frombuffer(raw_bytes, dtype=np.uint8)
+        uncompressed_size = LZ4._get_uncompressed_size(raw_data, dtype)
 
-        # Read uncompressed size (first 4 bytes). Same endianness as the array.
-        endianness = "big" if (type(dtype) == str and dtype.startswith(">")) else "little"
-        fmt = "<I" if endianness == "little" else ">I"
-        uncompressed_size = struct.unpack(fmt, raw_data[:4])[0]
+        unpacked_shape = get_unpacked_shape_from_size(uncompressed_size, dtype, shape)
+        if unpacked_shape is None:
+            return None
 
-        # Decompress payload
-        decompressed_bytes = lz4.block.decompress(
-            raw_data[4:],
-            uncompressed_size=uncompressed_size
-        )
+        out = _get_output_array(out, np.dtype(dtype), unpacked_shape)
+        out_bytes = out.reshape(-1).view(np.uint8)
 
-        # Convert bytes to numpy array
-        raw_data = np.frombuffer(decompressed_bytes, dtype=dtype)
+        # Decompress the payload directly into the output array.
+        if _lz4_decompress_safe is not None:
+            payload = raw_data[4:]
+            n_bytes = _lz4_decompress_safe(payload.ctypes.data, out.ctypes.data, payload.size, out.nbytes)
+            if n_bytes < 0:
+                raise ValueError(f"LZ4 decompression failed with error {n_bytes}.")
 
-        if raw_data.size == 0:
+        else:
+            decompressed_bytes = lz4.block.decompress(raw_data[4:], uncompressed_size=out.nbytes)
+            n_bytes = len(decompressed_bytes)
+            out_bytes[:n_bytes] = np.frombuffer(decompressed_bytes, dtype=np.uint8)
+
+        if n_bytes != out.nbytes:
+            raise ValueError(f"LZ4 decompression failed - {n_bytes} bytes decompressed, {out.nbytes} expected.")
+
+        return out
+
+    @staticmethod
+    def get_unpacked_shape(raw_bytes, dtype, shape=None):
+        """
+        Get the shape of the array unpack_data returns, from the header of the raw bytes.
+        :param raw_bytes: Raw bytes to convert (lz4-compressed).
+        :param dtype: dtype to use for the result.
+        :param shape: Shape of the result.
+        :return: Numpy shape (slowest dimension first), None if the raw bytes hold no data.
+        """
+        if not raw_bytes:
             return None
 
-        # Do not reshape scalars
-        if shape is not None and shape != [1]:
-            # Numpy is slowest dimension first, but bsread is fastest dimension first
-            raw_data = raw_data.reshape(shape[::-1])
+        raw_data = np.frombuffer(raw_bytes, dtype=np.uint8)
+        return get_unpacked_shape_from_size(LZ4._get_uncompressed_size(raw_data, dtype), dtype, shape)
 
-        return raw_data
+    # LZ4 does not compress more than by this factor - a larger uncompressed size in the header is invalid.
+    maximum_ratio = 255
+
+    @staticmethod
+    def _get_uncompressed_size(raw_data, dtype):
+        # Read uncompressed size (first 4 bytes). Always little endian (see pack_data), independent of the array.
+        uncompressed_size = struct.unpack("<I", raw_data[:4])[0]
+
+        # Checked before the output array is allocated for it.
+        if uncompressed_size > (raw_data.size - 4) * LZ4.maximum_ratio:
+            raise ValueError(f"Invalid uncompressed size {uncompressed_size} for {raw_data.size} raw bytes.")
+
+        return uncompressed_size
 
     @staticmethod
     def pack_data(numpy_array, dtype=None):
@@ -116,27 +260,126 @@ class BitshuffleLZ4:
 
     # numpy type definitions can be found at: http://docs.scipy.org/doc/numpy/reference/arrays.dtypes.html
     @staticmethod
-    def unpack_data(raw_bytes, dtype, shape=None):
+    def unpack_data(raw_bytes, dtype, shape=None, out=None):
         """
         Convert raw bytes into the specified numpy type.
         :param raw_bytes: Raw bytes to convert.
         :param dtype: dtype to use for the result.
         :param shape: Shape of the result.
+        :param out: Array (of the shape returned by get_unpacked_shape) to decompress into. By default a new array
+                    is allocated.
         :return: Numpy array of dtype and shape.
         """
+        return BitshuffleLZ4._unpack_data(raw_bytes, dtype, shape, out, _bshuf_decompress_lz4,
+                                          bitshuffle.decompress_lz4)
+
+    @staticmethod
+    def _unpack_data(raw_bytes, dtype, shape, out, native_decompress, decompress):
+        """
+        Unpack the header and decompress the payload - with the native function if available, the Python API
+        otherwise.
+        """
         # Interpret the bytes as a numpy array.
         raw_data = np.frombuffer(raw_bytes, dtype=np.uint8)
 
+        unpacked_shape, compression_block_size = BitshuffleLZ4._read_header(raw_data, dtype, shape)
+
+        if unpacked_shape is None:
+            return None
+
+        dtype = np.dtype(dtype)
+
+        if native_decompress is not None:
+            out = _get_output_array(out, dtype, unpacked_shape)
+
+            # The native function trusts the sizes - it is only called if the compressed blocks of out.size elements
+            # are within the payload.
+            payload = raw_data[12:]
+            compression_block_size = BitshuffleLZ4._check_payload(payload, out.size, dtype.itemsize,
+                                                                  compression_block_size)
+
+            # Decompress directly into the output array.
+            n_bytes = native_decompress(payload.ctypes.data, out.ctypes.data, out.size, dtype.itemsize,
+                                        compression_block_size)
+            if n_bytes < 0:
+                raise ValueError(f"Bitshuffle decompression failed with error {n_bytes}.")
+
+            return out
+
+        # Actual data.
+        byte_array = decompress(raw_data[12:], block_size=compression_block_size, shape=unpacked_shape, dtype=dtype)
+
+        if out is not None:
+            out = _get_output_array(out, dtype, unpacked_shape)
+            out[...] = byte_array
+            return out
+
+        return byte_array
+
+    @staticmethod
+    def _check_payload(payload, n_elements, n_bytes_per_element, compression_block_size):
+        """
+        Check that the compressed blocks of n_elements elements are within the payload - each block is prefixed with
+        its compressed size (big endian, uint32), the elements not filling a multiple of block_size_multiplier are
+        stored uncompressed at the end.
+        :return: Compression block size in elements (the default one if the header holds 0).
+        """
+        if compression_block_size == 0:
+            compression_block_size = BitshuffleLZ4.get_compression_block_size(n_bytes_per_element)
+
+        if compression_block_size < 0 or compression_block_size % BitshuffleLZ4.block_size_multiplier != 0:
+            raise ValueError(f"Invalid compression block size {compression_block_size}.")
+
+        n_blocks, n_last_block_elements = divmod(n_elements, compression_block_size)
+        if n_last_block_elements >= BitshuffleLZ4.block_size_multiplier:
+            n_blocks += 1
+
+        offset = 0
+        payload_size = payload.size
+        payload_buffer = payload.data
+
+        for _ in range(n_blocks):
+            if offset + 4 > payload_size:
+                break
+            offset += 4 + struct.unpack_from(">I", payload_buffer, offset)[0]
+
+        else:
+            n_leftover_bytes = (n_elements % BitshuffleLZ4.block_size_multiplier) * n_bytes_per_element
+            if offset + n_leftover_bytes <= payload_size:
+                return compression_block_size
+
+        raise ValueError(f"Compressed data of {n_elements} elements exceeds the payload of {payload_size} bytes.")
+
+    @staticmethod
+    def get_unpacked_shape(raw_bytes, dtype, shape=None):
+        """
+        Get the shape of the array unpack_data returns, from the header of the raw bytes.
+        :param raw_bytes: Raw bytes to convert.
+        :param dtype: dtype to use for the result.
+        :param shape: Shape of the result.
+        :return: Numpy shape (slowest dimension first), None if the raw bytes hold no data.
+        """
+        return BitshuffleLZ4._read_header(np.frombuffer(raw_bytes, dtype=np.uint8), dtype, shape)[0]
+
+    @staticmethod
+    def _read_header(raw_data, dtype, shape):
+        """
+        :return: Tuple (numpy shape of the unpacked data, compression block size in elements) - shape None if the
+                 raw data holds an empty array.
+        """
         # If the numpy array is empty, return it as such.
         if raw_data.size == 0:
-            return None
+            return None, None
+
+        if raw_data.size < 12:
+            raise ValueError(f"Raw bytes of size {raw_data.size} are too short for the header.")
 
         # Uncompressed block size, big endian, int64 (long long)
         unpacked_length = struct.unpack(">q", raw_data[0:8].tobytes())[0]
 
         # Empty array was transmitted.
         if unpacked_length == 0:
-            return None
+            return None, None
 
         # Type of the output array.
         dtype = np.dtype(dtype)
@@ -154,38 +397,36 @@ class BitshuffleLZ4:
         if shape is None or (shape == [1] and n_elements > 1):
             shape = (n_elements,)
 
+        # The data is decompressed into an array of the shape - it must not hold more elements than transmitted.
+        if int(np.prod(shape)) > n_elements:
+            raise ValueError(f"Shape {shape} does not match the unpacked length {unpacked_length}.")
+
         # Compression block size, big endian, int32 (int). Divide by number of bytes per element.
         header_compression_block_size = struct.unpack(">i", raw_data[8:12].tobytes())[0]
-        n_bytes_per_element = np.dtype(dtype).itemsize
-        compression_block_size = header_compression_block_size / n_bytes_per_element
-
-        # If shape is not provided use the original length.
-        if shape is None:
-            shape = (unpacked_length,)
+        compression_block_size = header_compression_block_size // n_bytes_per_element
 
         # Numpy is slowest dimension first, but bsread is fastest dimension first.
-        shape = shape[::-1]
-
-        # Actual data.
-        byte_array = bitshuffle.decompress_lz4(raw_data[12:], block_size=compression_block_size,
-                                               shape=shape, dtype=dtype)
-
-        return byte_array
+        return tuple(shape[::-1]), compression_block_size
 
 
     @staticmethod
-    def pack_data(numpy_array, dtype):
+    def pack_data(numpy_array, dtype, block_size=None):
         """
         Compress the provided numpy array.
         :param numpy_array: Array to compress.
         :param dtype: Data type (Numpy).
+        :param block_size: Target compression block size in bytes - default: target_block_size.
         :return: Header (unpacked length, compression block size) + Compressed data
         """
+        return BitshuffleLZ4._pack_data(numpy_array, dtype, bitshuffle.compress_lz4, block_size)
+
+    @staticmethod
+    def _pack_data(numpy_array, dtype, compress, block_size=None):
         # Uncompressed block size, big endian, int64 (long long)
         unpacked_length_bytes = struct.pack(">q", numpy_array.nbytes)
 
         n_bytes_per_element = np.dtype(dtype).itemsize
-        compression_block_size = BitshuffleLZ4.get_compression_block_size(n_bytes_per_element)
+        compression_block_size = BitshuffleLZ4.get_compression_block_size(n_bytes_per_element, block_size)
 
         # We multiply the compression block size by the n_bytes_per_element, because the HDF5 filter does so.
         # https://github.com/kiyo-masui/bitshuffle/blob/04e58bd553304ec26e222654f1d9b6ff64e97d10/src/bshuf_h5filter.c#L167
@@ -193,7 +434,7 @@ class BitshuffleLZ4:
         # Compression block size, big endian, int32 (int).
         block_size_bytes = struct.pack(">i", header_compression_block_size)
 
-        compressed_bytes = bitshuffle.compress_lz4(numpy_array, compression_block_size).tobytes()
+        compressed_bytes = compress(numpy_array, compression_block_size).tobytes()
 
         return unpacked_length_bytes + block_size_bytes + compressed_bytes
 
@@ -203,9 +444,16 @@ class BitshuffleLZ4:
 
 
     @staticmethod
-    def get_compression_block_size(n_bytes_per_element):
+    def get_compression_block_size(n_bytes_per_element, target_block_size=None):
+        """
+        :param n_bytes_per_element: Size of an element in bytes.
+        :param target_block_size: Target block size in bytes - default: target_block_size.
+        :return: Compression block size in elements.
+        """
+        if target_block_size is None:
+            target_block_size = BitshuffleLZ4.target_block_size
 
-        block_size = BitshuffleLZ4.target_block_size / n_bytes_per_element
+        block_size = target_block_size / n_bytes_per_element
 
         # Make the target block size the closest multiple of block_size_multiplier.
         block_size = (block_size // BitshuffleLZ4.block_size_multiplier) * BitshuffleLZ4.block_size_multiplier
@@ -217,3 +465,117 @@ class BitshuffleLZ4:
 
 
 
+class BitshuffleZstd(BitshuffleLZ4):
+    """
+    Bitshuffle with zstd instead of lz4 - better compression ratio at a higher (compression) CPU cost. Same header
+    (unpacked length, compression block size) as bitshuffle_lz4.
+    """
+
+    available = bitshuffle_compress_zstd is not None
+
+    # zstd compression level - higher levels compress better but slower. Decompression speed is hardly affected.
+    compression_level = 3
+
+    @staticmethod
+    def unpack_data(raw_bytes, dtype, shape=None, out=None):
+        """
+        Convert raw bytes into the specified numpy type.
+        :param raw_bytes: Raw bytes to convert.
+        :param dtype: dtype to use for the result.
+        :param shape: Shape of the result.
+        :param out: Array (of the shape returned by get_unpacked_shape) to decompress into. By default a new array
+                    is allocated.
+        :return: Numpy array of dtype and shape.
+        """
+        return BitshuffleLZ4._unpack_data(raw_bytes, dtype, shape, out, _bshuf_decompress_zstd,
+                                          bitshuffle_decompress_zstd)
+
+    @staticmethod
+    def pack_data(numpy_array, dtype, block_size=None):
+        """
+        Compress the provided numpy array.
+        :param numpy_array: Array to compress.
+        :param dtype: Data type (Numpy).
+        :param block_size: Target compression block size in bytes - default: target_block_size.
+        :return: Header (unpacked length, compression block size) + Compressed data
+        """
+        return BitshuffleLZ4._pack_data(numpy_array, dtype, BitshuffleZstd._compress, block_size)
+
+    @staticmethod
+    def _compress(numpy_array, block_size):
+        return bitshuffle_compress_zstd(numpy_array, block_size, BitshuffleZstd.compression_level)
+
+
+
+class Blosc2:
+    """
+    Blosc2 chunk (bitshuffle + zstd by default). Blosc2 splits the data into blocks and (de)compresses them with
+    its own thread pool. The chunk header holds the uncompressed size - no additional header is needed.
+    """
+
+    available = blosc2 is not None
+
+    # Names of the blosc2.Codec and blosc2.Filter used for compression. Decompression reads them from the chunk.
+    codec = "ZSTD"
+    shuffle_filter = "BITSHUFFLE"
+    compression_level = 5
+
+    # Number of threads used by blosc2 - None uses the blosc2 default (blosc2.nthreads).
+    n_threads = None
+
+    @staticmethod
+    def unpack_data(raw_bytes, dtype, shape=None, out=None):
+        """
+        Convert raw bytes into the specified numpy type.
+        :param raw_bytes: Raw bytes to convert (blosc2 chunk).
+        :param dtype: dtype to use for the result.
+        :param shape: Shape of the result.
+        :param out: Array (of the shape returned by get_unpacked_shape) to decompress into. By default a new array
+                    is allocated.
+        :return: Numpy array of dtype and shape.
+        """
+        unpacked_shape = Blosc2.get_unpacked_shape(raw_bytes, dtype, shape)
+        if unpacked_shape is None:
+            return None
+
+        out = _get_output_array(out, np.dtype(dtype), unpacked_shape)
+        blosc2.decompress2(raw_bytes, dst=out, nthreads=Blosc2.n_threads or blosc2.nthreads)
+
+        return out
+
+    @staticmethod
+    def get_unpacked_shape(raw_bytes, dtype, shape=None):
+        """
+        Get the shape of the array unpack_data returns, from the header of the raw bytes.
+        :param raw_bytes: Raw bytes to convert (blosc2 chunk).
+        :param dtype: dtype to use for the result.
+        :param shape: Shape of the result.
+        :return: Numpy shape (slowest dimension first), None if the raw bytes hold no data.
+        """
+        if not raw_bytes:
+            return None
+
+        uncompressed_size = blosc2.get_cbuffer_sizes(raw_bytes)[0]
+        unpacked_shape = get_unpacked_shape_from_size(uncompressed_size, dtype, shape)
+        n_bytes_per_element = np.dtype(dtype).itemsize
+
+        # Blosc2 does not decompress into a smaller or larger array.
+        if unpacked_shape is not None and int(np.prod(unpacked_shape)) * n_bytes_per_element != uncompressed_size:
+            raise ValueError(f"Shape {shape} does not match the uncompressed size {uncompressed_size}.")
+
+        return unpacked_shape
+
+    @staticmethod
+    def pack_data(numpy_array, dtype=None):
+        """
+        Compress the provided numpy array.
+        :param numpy_array: Array to compress.
+        :param dtype: Data type (Numpy) - its size is used as type size for shuffling.
+        :return: Blosc2 chunk.
+        """
+        numpy_array = np.ascontiguousarray(numpy_array)
+        typesize = np.dtype(dtype).itemsize if dtype is not None else numpy_array.itemsize
+
+        return blosc2.compress2(numpy_array, codec=getattr(blosc2.Codec, Blosc2.codec),
+                                filters=[getattr(blosc2.Filter, Blosc2.shuffle_filter)], clevel=Blosc2.compression_level,
+                                typesize=typesize, nthreads=Blosc2.n_threads or blosc2.nthreads)
@@ -1,12 +1,17 @@
+import functools
+import struct
 import sys
 import traceback
 from logging import getLogger, DEBUG
 
 import numpy as np
 
+from .compression import BitshuffleLZ4, NoCompression
 from .serialization import (channel_type_deserializer_mapping,
                             channel_type_scalar_serializer_mapping,
                             compression_provider_mapping,
+                            deserialize_number,
+                            dtype_struct_format_mapping,
                             serialize_python_list)
 
 
@@ -86,10 +91,31 @@ def get_extended_channel_specs(value):
     return dtype, channel_type, serializer, shape
 
 
-def get_channel_reader(channel):
+def get_value_fingerprint(value):
+    """
+    Cheap fingerprint of the channel specification (type, shape, encoding) of a value to be sent.
+    Values with the same fingerprint result in the same channel metadata.
+    :param value: Value to fingerprint.
+    :return: Hashable fingerprint.
+    """
+    if isinstance(value, np.ndarray):
+        # The dtype string includes the byte order.
+        return value.dtype.str, value.shape
+
+    if isinstance(value, list):
+        # Type and shape of lists can only be determined by converting them.
+        channel_type, shape = get_channel_specs(value)
+        return list, channel_type, tuple(shape)
+
+    # The type of scalars (and strings) fully determines the channel specification.
+    return type(value)
+
+
+def get_channel_reader(channel, allocator=None):
     """
     Construct a value reader for the provided channel.
     :param channel: Channel to construct the value reader for.
+    :param allocator: Function (dtype, shape) -> array providing the arrays compressed values are unpacked into.
     :return: Value reader.
     """
     # If no channel type is specified, float64 is assumed.
@@ -103,10 +129,30 @@ def get_channel_reader(channel):
     shape = channel["shape"] if "shape" in channel else None
     endianness = channel["encoding"]
 
-    value_reader = get_value_reader(channel_type, compression, shape, endianness, name)
+    value_reader = get_value_reader(channel_type, compression, shape, endianness, name, allocator)
     return value_reader
 
 
+def get_scalar_dtype(channel):
+    """
+    Get the numpy dtype of an uncompressed scalar channel.
+    :param channel: Channel (from the data header, with encoding "<" or ">").
+    :return: dtype including endianness, None if the channel is not an uncompressed numeric scalar.
+    """
+    channel_type = channel["type"].lower() if "type" in channel else "float64"
+
+    if channel_type not in channel_type_deserializer_mapping \
+            or compression_provider_mapping.get(channel.get("compression")) is not NoCompression \
+            or channel.get("shape") not in (None, [1]):
+        return None
+
+    dtype, serializer = channel_type_deserializer_mapping[channel_type]
+    if serializer is not deserialize_number:
+        return None
+
+    return channel["encoding"] + dtype
+
+
 def get_serialization_type(channel_type):
     default_serialization_type = "uint8"
 
@@ -119,7 +165,7 @@ def get_serialization_type(channel_type):
     return channel_type_deserializer_mapping[channel_type][0]
 
 
-def get_value_reader(channel_type, compression, shape=None, endianness="", value_name=None):
+def get_value_reader(channel_type, compression, shape=None, endianness="", value_name=None, allocator=None):
     """
     Get the correct value reader for the specific channel type and compression.
     :param channel_type: Channel type.
@@ -127,6 +173,8 @@ def get_value_reader(channel_type, compression, shape=None, endianness="", value
     :param shape: Shape of the data.
     :param endianness: Encoding of the channel: < (small endian) or > (big endian)
     :param value_name: Name of the value to decode. For logging.
+    :param allocator: Function (dtype, shape) -> array providing the arrays compressed array values are unpacked into
+                      (e.g. from a buffer pool). By default new arrays are allocated.
     :return: Object capable of reading the data, when get_value() is called on it.
     """
     # If the type is unknown, NoneProvider should be used.
@@ -141,11 +189,26 @@ def get_value_reader(channel_type, compression, shape=None, endianness="", value
         # If the channel compression is not supported, always return None.
         return lambda x: None
 
-    decompressor = compression_provider_mapping[compression].unpack_data
+    compression_provider = compression_provider_mapping[compression]
+    decompressor = compression_provider.unpack_data
     dtype, serializer = channel_type_deserializer_mapping[channel_type]
     # Expand the dtype with the correct endianness.
     dtype = endianness + dtype
 
+    # Uncompressed values are views of the received frame - only decompressed values need an array. Scalars and
+    # strings do not keep the decompressed array.
+    if allocator is not None and compression_provider is not NoCompression \
+            and serializer is deserialize_number and shape not in (None, [1]):
+        numpy_dtype = np.dtype(dtype)
+
+        def decompressor(raw_data, dtype, shape):
+            unpacked_shape = compression_provider.get_unpacked_shape(raw_data, dtype, shape)
+            if unpacked_shape is None:
+                return None
+
+            return compression_provider.unpack_data(raw_data, dtype, shape,
+                                                    out=allocator(numpy_dtype, unpacked_shape))
+
     def value_reader(raw_data):
         try:
             # Decompress and deserialize the received value.
@@ -162,8 +225,37 @@ def get_value_reader(channel_type, compression, shape=None, endianness="", value
                 _logger.debug(f'Decoding failed: value name "{value_name}" with dtype="{channel_type}", shape="{shape}", compression="{compression}", raw_data_length="{len(raw_data)}" and raw_data="{raw_data}". Exception: {e}')
             return None
 
+    # Uncompressed scalars are unpacked with a precompiled struct - much cheaper than creating a numpy array for a
+    # single value.
+    if serializer is deserialize_number and decompressor is NoCompression.unpack_data and shape in (None, [1]):
+        return get_scalar_value_reader(channel_type_deserializer_mapping[channel_type][0], endianness, value_reader)
+
     return value_reader
 
+
+def get_scalar_value_reader(dtype, endianness, fallback_reader):
+    """
+    Construct a value reader for uncompressed scalars using a precompiled struct unpacker.
+    :param dtype: Numpy dtype of the scalar (without endianness).
+    :param endianness: Encoding of the channel: < (small endian) or > (big endian)
+    :param fallback_reader: Reader used for raw data that does not hold exactly one value.
+    :return: Value reader returning numpy scalars (as the generic reader does).
+    """
+    unpacker = struct.Struct((endianness or "=") + dtype_struct_format_mapping[dtype])
+    unpack = unpacker.unpack
+    size = unpacker.size
+    scalar_type = np.dtype(dtype).type
+
+    def scalar_value_reader(raw_data):
+        if raw_data is not None and len(raw_data) == size:
+            return scalar_type(unpack(raw_data)[0])
+
+        # Empty data, arrays or invalid sizes.
+        return fallback_reader(raw_data)
+
+    return scalar_value_reader
+
+
 def get_value_bytes(value, compression=None, channel_type=None):
     """
     Based on the value, get the compressed bytes.
@@ -191,4 +283,81 @@ def get_value_bytes(value, compression=None, channel_type=None):
     return compressed_bytes_array
 
 
+def get_value_encoder(channel_type, compression=None, copy_arrays=True, block_size=None):
+    """
+    Construct an encoder producing the same bytes as get_value_bytes, but with the channel specific work (type
+    lookups, struct formats, compressor) done once.
+    :param channel_type: Channel type. If not specified, the type is derived from each value (generic path).
+    :param compression: Compression of the channel.
+    :param copy_arrays: If False, uncompressed (contiguous) numpy arrays are returned as they are (buffer protocol)
+                        instead of copying them to bytes. Only safe if the caller copies the data anyway.
+    :param block_size: Compression block size in bytes of arrays - only for the bitshuffle compressions. Default:
+                       BitshuffleLZ4.target_block_size.
+    :return: Function converting a value into bytes (or a buffer).
+    """
+    if compression not in compression_provider_mapping:
+        error_message = f"Channel compression '{compression}' not supported."
+        _logger.error(error_message)
+        raise ValueError(error_message)
+
+    def generic_encoder(value):
+        return get_value_bytes(value, compression, channel_type=channel_type)
+
+    if channel_type is None or channel_type not in channel_type_deserializer_mapping:
+        return generic_encoder
+
+    dtype = get_serialization_type(channel_type)
+    compression_provider = compression_provider_mapping[compression]
+    compressor = compression_provider.pack_data
+
+    if block_size is not None:
+        if not issubclass(compression_provider, BitshuffleLZ4):
+            raise ValueError(f"Compression block size not supported by compression '{compression}'.")
+
+        compressor = functools.partial(compressor, block_size=block_size)
+
+    # Compressed channels - only arrays are compressed with the bound compressor, everything else is rare.
+    if compression_provider is not NoCompression:
+        def compressed_encoder(value):
+            if isinstance(value, np.ndarray):
+                return compressor(value, dtype)
+            return generic_encoder(value)
+
+        return compressed_encoder
+
+    if channel_type == "string":
+        def string_encoder(value):
+            if type(value) is str:
+                return value.encode()
+            return generic_encoder(value)
+
+        return string_encoder
+
+    # Python numbers are packed in native byte order, as numpy does.
+    pack = struct.Struct("=" + dtype_struct_format_mapping[dtype]).pack
+    kind = np.dtype(dtype).kind
+    # Python types that struct packs exactly like numpy converts them (e.g. no floats into integer channels).
+    scalar_types = (float, int, bool) if kind == "f" else (int, bool)
+
+    def encoder(value):
+        value_type = type(value)
+
+        if value_type in scalar_types:
+            try:
+                return pack(value)
+            except (struct.error, OverflowError):
+                # Out of the range of the channel type - numpy converts (e.g. to inf) or raises its own error.
+                return generic_encoder(value)
+
+        # Numpy scalars and arrays are sent with their own dtype.
+        if isinstance(value, np.generic):
+            return value.tobytes()
+
+        if value_type is np.ndarray:
+            if not copy_arrays and value.flags.c_contiguous:
+                return value
+            return value.tobytes()
+
+        return generic_encoder(value)
 
+    return encoder
@@ -0,0 +1,68 @@
+import json
+from logging import getLogger
+
+_logger = getLogger(__name__)
+
+
+def _json_loads(data):
+    # The standard library does not accept memoryviews (zero-copy frames).
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def _json_dumps(obj):
+    return json.dumps(obj).encode("utf-8")
+
+
+# Backend name: (loads, dumps) - loads accepts str, bytes or memoryview, dumps returns UTF-8 encoded bytes.
+available_backends = {
+    "json": (_json_loads, _json_dumps)
+}
+
+try:
+    import orjson
+
+    available_backends["orjson"] = (orjson.loads,
+                                    lambda obj: orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY))
+except ImportError:
+    pass
+
+try:
+    import ujson
+
+    def _ujson_loads(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return ujson.loads(data)
+
+    available_backends["ujson"] = (_ujson_loads, lambda obj: ujson.dumps(obj).encode("utf-8"))
+except ImportError:
+    pass
+
+
+# Fastest available backend first.
+default_backend = next(name for name in ("orjson", "ujson", "json") if name in available_backends)
+
+backend = None
+loads = None
+dumps = None
+
+
+def set_backend(name):
+    """
+    Select the JSON backend used to encode and decode the bsread headers.
+    :param name: Name of the backend - one of available_backends.
+    """
+    global backend, loads, dumps
+
+    if name not in available_backends:
+        raise ValueError(f'JSON backend "{name}" not available. Available: {list(available_backends.keys())}')
+
+    loads, dumps = available_backends[name]
+    backend = name
+
+    _logger.debug(f"Using JSON backend {name}.")
+
+
+set_backend(default_backend)
@@ -2,7 +2,7 @@ from logging import getLogger
 
 import numpy as np
 
-from .compression import BitshuffleLZ4, NoCompression, LZ4
+from .compression import BitshuffleLZ4, BitshuffleZstd, Blosc2, NoCompression, LZ4
 
 _logger = getLogger(__name__)
 
@@ -79,6 +79,13 @@ compression_provider_mapping = {
     "bitshuffle_lz4": BitshuffleLZ4
 }
 
+# Optional compression providers - only available if the libraries are installed.
+if BitshuffleZstd.available:
+    compression_provider_mapping["bitshuffle_zstd"] = BitshuffleZstd
+
+if Blosc2.available:
+    compression_provider_mapping["blosc2"] = Blosc2
+
 
 # Channel type to numpy dtype and serializer mapping.
 # channel_type: (dtype, deserializer)
@@ -100,6 +107,22 @@ channel_type_deserializer_mapping = {
 }
 
 
+# Numpy dtype to struct format character mapping (standard sizes).
+dtype_struct_format_mapping = {
+    "i1": "b",
+    "u1": "B",
+    "i2": "h",
+    "u2": "H",
+    "i4": "i",
+    "u4": "I",
+    "i8": "q",
+    "u8": "Q",
+    "f4": "f",
+    "f8": "d",
+    "?": "?"
+}
+
+
 # Value to send to channel type and serializer mapping.
 # type(value): (dtype, channel_type, serializer, shape)
 channel_type_scalar_serializer_mapping = {
@@ -1,55 +1,92 @@
-import json
 import logging
 from collections import OrderedDict
 
 import numpy as np
 
-from bsread.data.helpers import get_channel_reader, get_value_reader
+from bsread.data import json_backend
+from bsread.handlers.plans import DecoderPlanCache, decoder_plan_cache
 
 
 class Handler:
 
-    def __init__(self):
-        # Used for detecting if the data header has changed - we need to reconstruct the channel definitions.
+    def __init__(self, plan_cache=None, lazy=False, projection=None, executor=None, parallel_threshold=65536,
+                 allocator=None, buffer_pool=None):
+        """
+        :param plan_cache: Cache of decoder plans - by default the cache shared by all handlers is used. Handlers with
+                           an allocator (or buffer pool) get their own cache by default, the plans reference the
+                           allocator and would keep it alive in the shared cache.
+        :param lazy: If True, channel values are only decompressed and deserialized on first access.
+        :param projection: List of channel names to decode. All other channels are skipped and are not part of
+                           the message. None decodes all channels.
+        :param executor: Executor (e.g. concurrent.futures.ThreadPoolExecutor) used to decompress the compressed
+                         channels of a message concurrently. None decompresses all channels on the receiving thread.
+        :param parallel_threshold: Minimum size in bytes of a compressed value to be decompressed by the executor.
+                                   Smaller values are decompressed inline.
+        :param allocator: Function (dtype, shape) -> array providing the arrays compressed values are decompressed
+                          into. By default new arrays are allocated.
+        :param buffer_pool: BufferPool to decompress values into - its arrays are recycled by releasing the received
+                            messages (Message.release()). Used as allocator if no allocator is given.
+        """
+        self.lazy = lazy
+        self.projection = frozenset(projection) if projection is not None else None
+        self.executor = executor
+        self.parallel_threshold = parallel_threshold
+        self.buffer_pool = buffer_pool
+        self.allocator = allocator if allocator is not None or buffer_pool is None else buffer_pool.allocate
+
+        # Used for detecting if the data header has changed - we need to look up the channel definitions.
         self.data_header_hash = None
         self.channels_definitions = None
+        self.scalar_groups = None
+        self.channels_scalar_groups = None
+        self.channels_compressed = None
 
+        if plan_cache is None:
+            plan_cache = decoder_plan_cache if self.allocator is None else DecoderPlanCache()
+        self.plan_cache = plan_cache
 
-    def receive(self, receiver):
-        # Receive main header
-        header = receiver.next(as_json=True)
 
-        # We cannot process an empty Header.
-        if not header:
-            return None
+    def receive(self, receiver, header_filter=None):
+        """
+        :param receiver: mflow receiver to read the frames from.
+        :param header_filter: Function evaluated on the (not yet populated) message right after the main header
+                              was parsed, i.e. only pulse_id, global_timestamp(_offset) and hash are available.
+                              Messages for which it returns False are dropped without decoding their data and the
+                              next message is received.
+        :return: Message
+        """
+        while True:
+            # Receive main header
+            raw_header = receiver.next()
 
-        message = Message()
-        message.pulse_id = header["pulse_id"]
-        message.hash = header["hash"]
+            # We cannot process an empty Header.
+            if not raw_header:
+                return None
 
-        if "global_timestamp" in header:
-            if "sec" in header["global_timestamp"]:
-                message.global_timestamp = header["global_timestamp"]["sec"]
-            elif "epoch" in header["global_timestamp"]:
-                message.global_timestamp = header["global_timestamp"]["epoch"]
-            else:
-                raise RuntimeError(f"Invalid timestamp format in BSDATA header message {message}")
+            header = json_backend.loads(raw_header)
 
-            message.global_timestamp_offset = header["global_timestamp"]["ns"]
+            message = self._parse_main_header(header)
+
+            if header_filter is None or header_filter(message):
+                break
 
-        # Receiver data header, check if header has changed - and in this case recreate the channel definitions.
+            # Drain the data frames of the rejected message.
+            while receiver.has_more():
+                receiver.next()
+
+        # Receive data header, check if header has changed - and in this case look up the channel definitions.
         if receiver.has_more() and (self.data_header_hash != header["hash"]):
             # Set the current header hash as the new hash.
             self.data_header_hash = header["hash"]
 
-            # Read the data header.
+            # Read the data header - it is only parsed if no plan is cached for this hash yet.
             data_header_bytes = receiver.next()
-            data_header = json.loads(get_value_reader("string", header.get("dh_compression"),
-                                                      value_name="data_header")(data_header_bytes))
+            plan = self.plan_cache.get(header["hash"], data_header_bytes, header.get("dh_compression"),
+                                       self.projection, self.allocator)
 
             # If a message with ho channel information is received,
             # ignore it and return from function with no data.
-            if not data_header["channels"]:
+            if not plan.channels_definitions:
                 logging.warning("Received message without channels.")
                 while receiver.has_more():
                     # Drain rest of the messages - if entering this code there is actually something wrong
@@ -57,16 +94,10 @@ class Handler:
 
                 return message
 
-            #TODO: Why do we need to pre-process the message? Source change?
-            for channel in data_header["channels"]:
-                # Define endianness of data
-                # > - big endian
-                # < - little endian (default)
-                channel["encoding"] = ">" if channel.get("encoding") == "big" else "<"
-
-            # Construct the channel definitions.
-            self.channels_definitions = [(channel["name"], channel["encoding"], get_channel_reader(channel))
-                                         for channel in data_header["channels"]]
+            self.channels_definitions = plan.channels_definitions
+            self.scalar_groups = plan.scalar_groups
+            self.channels_scalar_groups = plan.channels_scalar_groups
+            self.channels_compressed = plan.channels_compressed
 
             # Signal that the format has changed.
             message.format_changed = True
@@ -74,18 +105,48 @@ class Handler:
             # Skip second header - we already have the receive functions setup.
             receiver.next()
 
+        # Uncompressed scalars are collected per dtype group and decoded together once all frames are read.
+        if not self.lazy:
+            scalar_group_values = [[] for _ in self.scalar_groups]
+            scalar_group_frames = [[] for _ in self.scalar_groups]
+
+        # Values decompressed by the executor - (value, future) pairs, resolved once all frames are read.
+        pending_values = []
+        parallel = self.executor is not None and not self.lazy
+
         # Receiving data
         counter = 0
 
         #TODO: add some more error checking
         while receiver.has_more():
             channel_name, channel_endianness, channel_reader = self.channels_definitions[counter]
+            scalar_group = self.channels_scalar_groups[counter]
+            counter += 1
 
+            # Channel not in projection - drop its value and timestamp frame without decoding.
+            if channel_reader is None:
+                receiver.next()
+                if receiver.has_more():
+                    receiver.next()
+                continue
+
+            # Either bytes or - if the source was created with copy=False - a memoryview of the zmq frame.
+            # The value readers decode directly from this buffer, arrays keep a reference to the frame.
             raw_data = receiver.next()
-            channel_value = Value()
 
             if raw_data:
-                channel_value.value = channel_reader(raw_data)
+                if self.lazy:
+                    # Keep the raw frame, the value is only decoded on first access.
+                    channel_value = LazyValue(raw_data, channel_reader)
+                elif scalar_group is not None and len(raw_data) == self.scalar_groups[scalar_group].itemsize:
+                    channel_value = Value()
+                    scalar_group_values[scalar_group].append(channel_value)
+                    scalar_group_frames[scalar_group].append(raw_data)
+                elif parallel and self.channels_compressed[counter - 1] and len(raw_data) >= self.parallel_threshold:
+                    channel_value = Value()
+                    pending_values.append((channel_value, self.executor.submit(channel_reader, raw_data)))
+                else:
+                    channel_value = Value(channel_reader(raw_data))
 
                 if receiver.has_more():
 
@@ -96,12 +157,42 @@ class Handler:
                         channel_value.timestamp = timestamp_array[0]  # Second past epoch
                         channel_value.timestamp_offset = timestamp_array[1]  # Nanoseconds offset
             else:
+                channel_value = Value()
+
                 # Consume empty timestamp message
                 if receiver.has_more():
                     receiver.next()  # Read empty timestamp message
 
             message.data[channel_name] = channel_value
-            counter += 1
+
+        if not self.lazy:
+            for dtype, values, frames in zip(self.scalar_groups, scalar_group_values, scalar_group_frames):
+                if values:
+                    for channel_value, value in zip(values, np.frombuffer(b"".join(frames), dtype=dtype)):
+                        channel_value.value = value
+
+        # The value readers do not raise - decoding errors result in None.
+        for channel_value, future in pending_values:
+            channel_value.value = future.result()
+
+        return message
+
+
+    def _parse_main_header(self, header):
+        message = Message()
+        message.buffer_pool = self.buffer_pool
+        message.pulse_id = header["pulse_id"]
+        message.hash = header["hash"]
+
+        if "global_timestamp" in header:
+            if "sec" in header["global_timestamp"]:
+                message.global_timestamp = header["global_timestamp"]["sec"]
+            elif "epoch" in header["global_timestamp"]:
+                message.global_timestamp = header["global_timestamp"]["epoch"]
+            else:
+                raise RuntimeError(f"Invalid timestamp format in BSDATA header message {message}")
+
+            message.global_timestamp_offset = header["global_timestamp"]["ns"]
 
         return message
 
@@ -121,6 +212,35 @@ class Message:
 
         self.format_changed = False
 
+        # Pool the decompressed arrays of the values are returned to on release.
+        self.buffer_pool = None
+
+
+    def release(self):
+        """
+        Return the decompressed arrays of this message to the buffer pool it was received with. The values returned
+        to the pool are set to None - they must not be used (or referenced) anymore after releasing the message.
+        Values not decoded yet (lazy) are not touched.
+        """
+        if self.buffer_pool is None:
+            return
+
+        for channel_value in self.data.values():
+            if isinstance(channel_value, LazyValue) and not channel_value.is_decoded:
+                continue
+
+            value = channel_value.value
+            if isinstance(value, np.ndarray) and self.buffer_pool.release(value):
+                channel_value.value = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
 
     def __str__(self):
         message = f"pulse_id: {self.pulse_id} \ndata: {self.data}"
@@ -137,3 +257,140 @@ class Value:
 
 
 
+class LazyValue(Value):
+
+    def __init__(self, raw_data, value_reader, timestamp=None, timestamp_offset=None):
+        """
+        Value that is decoded from the raw frame on first access.
+        :param raw_data: Raw bytes of the value.
+        :param value_reader: Reader used to decode the raw bytes.
+        """
+        self._raw_data = raw_data
+        self._value_reader = value_reader
+        self._value = None
+
+        self.timestamp = timestamp
+        self.timestamp_offset = timestamp_offset
+
+
+    @property
+    def value(self):
+        if self._value_reader is not None:
+            self._value = self._value_reader(self._raw_data)
+
+            # Release the raw frame.
+            self._raw_data = None
+            self._value_reader = None
+
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._raw_data = None
+        self._value_reader = None
+
+
+    @property
+    def is_decoded(self):
+        return self._value_reader is None
+
+
+
+class MessageBatch:
+
+    def __init__(self, size):
+        """
+        Columnar container for up to size messages.
+        :param size: Maximum number of messages in the batch - used to preallocate the arrays.
+        """
+        self.size = size
+        self.n_messages = 0
+
+        self.pulse_id = np.zeros(size, dtype=np.int64)
+        self.global_timestamp = np.zeros(size, dtype=np.int64)
+        self.global_timestamp_offset = np.zeros(size, dtype=np.int64)
+        # Row i is False if message i has no global timestamp.
+        self.global_timestamp_valid = np.zeros(size, dtype=bool)
+
+        # Channel name -> array of shape (size, *value_shape). Row i holds the value of message i.
+        self.data = OrderedDict()
+        # Channel name -> bool array of shape (size,). Row i is False if the value of message i is missing.
+        self.valid = OrderedDict()
+
+
+    def add(self, message):
+        """
+        Copy the values of a message into the next row of the batch.
+        :param message: Message to add.
+        """
+        index = self.n_messages
+        if index >= self.size:
+            raise IndexError(f"Batch is full ({self.size} messages)")
+
+        self.pulse_id[index] = message.pulse_id
+        if message.global_timestamp is not None:
+            self.global_timestamp[index] = message.global_timestamp
+            self.global_timestamp_offset[index] = message.global_timestamp_offset
+            self.global_timestamp_valid[index] = True
+
+        for name, channel_value in message.data.items():
+            value = channel_value.value
+
+            # Missing values stay invalid.
+            if value is None:
+                continue
+
+            dtype, shape = self._get_column_specs(value)
+
+            if name not in self.data:
+                self.data[name] = np.zeros((self.size,) + shape, dtype=dtype)
+                self.valid[name] = np.zeros(self.size, dtype=bool)
+
+            column = self.data[name]
+
+            # Values not matching the column (e.g. after a format change) cannot be stored.
+            if column.dtype != dtype or column.shape[1:] != shape:
+                logging.warning(f"Value of channel '{name}' with dtype={dtype} and shape={shape} does not match "
+                                f"batch column with dtype={column.dtype} and shape={column.shape[1:]} - skipping.")
+                continue
+
+            column[index] = value
+            self.valid[name][index] = True
+
+        self.n_messages += 1
+
+
+    def truncate(self):
+        """
+        Shrink all arrays to the number of messages added (views, no copy).
+        """
+        n = self.n_messages
+        self.size = n
+
+        self.pulse_id = self.pulse_id[:n]
+        self.global_timestamp = self.global_timestamp[:n]
+        self.global_timestamp_offset = self.global_timestamp_offset[:n]
+        self.global_timestamp_valid = self.global_timestamp_valid[:n]
+
+        for name in self.data:
+            self.data[name] = self.data[name][:n]
+            self.valid[name] = self.valid[name][:n]
+
+
+    @staticmethod
+    def _get_column_specs(value):
+        # Strings are stored as objects, everything else as numpy arrays of the value dtype and shape.
+        if isinstance(value, str):
+            return np.dtype(object), ()
+
+        value = np.asarray(value)
+        return value.dtype, value.shape
+
+
+    def __len__(self):
+        return self.n_messages
+
+
+    def __str__(self):
+        return f"pulse_ids: {self.pulse_id} \nchannels: {list(self.data.keys())}"
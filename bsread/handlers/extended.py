@@ -1,26 +1,41 @@
-import json
 import logging
 
 import numpy as np
 
-from bsread.data.helpers import get_channel_reader, get_value_reader
+from bsread.data import json_backend
+from bsread.handlers.plans import DecoderPlanCache, decoder_plan_cache
 
 
 class Handler:
 
-    def __init__(self):
+    def __init__(self, plan_cache=None, allocator=None):
+        """
+        :param plan_cache: Cache of decoder plans - by default the cache shared by all handlers is used. Handlers with
+                           an allocator get their own cache by default, the plans reference the allocator and would
+                           keep it alive in the shared cache.
+        :param allocator: Function (dtype, shape) -> array providing the arrays compressed values are decompressed
+                          into (e.g. from a buffer pool). By default new arrays are allocated.
+        """
         self.data_header_hash = None
         self.data_header = None
         self.channels_definitions = None
 
+        self.allocator = allocator
+
+        if plan_cache is None:
+            plan_cache = decoder_plan_cache if self.allocator is None else DecoderPlanCache()
+        self.plan_cache = plan_cache
+
 
     def receive(self, receiver):
-        header = receiver.next(as_json=True)
+        raw_header = receiver.next()
 
         # We cannot process an empty Header.
-        if not header:
+        if not raw_header:
             return None
 
+        header = json_backend.loads(raw_header)
+
         return_value = {}
 
         data = []
@@ -36,14 +51,14 @@ class Handler:
 
             self.data_header_hash = header["hash"]
 
-            # Read the data header.
+            # Read the data header - it is only parsed if no plan is cached for this hash yet.
             data_header_bytes = receiver.next()
-            data_header = json.loads(get_value_reader("string", header.get("dh_compression"),
-                                                      value_name="data_header")(data_header_bytes))
+            plan = self.plan_cache.get(header["hash"], data_header_bytes, header.get("dh_compression"),
+                                       allocator=self.allocator)
 
             # If a message with ho channel information is received,
             # ignore it and return from function with no data.
-            if not data_header["channels"]:
+            if not plan.channels_definitions:
 
                 logging.warning("Received message without channels.")
 
@@ -60,18 +75,8 @@ class Handler:
 
                 return return_value
 
-            #TODO: Why do we need to pre-process the message? Source change?
-            for channel in data_header["channels"]:
-                # Define endianness of data
-                # > - big endian
-                # < - little endian (default)
-                channel["encoding"] = ">" if channel.get("encoding") == "big" else "<"
-
-            # Construct the channel definitions.
-            self.channels_definitions = [(channel["name"], channel["encoding"], get_channel_reader(channel))
-                                         for channel in data_header["channels"]]
-
-            self.data_header = data_header
+            self.channels_definitions = plan.channels_definitions
+            self.data_header = plan.data_header
         else:
             # Skip second header
             receiver.next()
@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+from bsread.data import json_backend
+from bsread.data.compression import NoCompression
+from bsread.data.helpers import get_channel_reader, get_scalar_dtype, get_value_reader
+from bsread.data.serialization import compression_provider_mapping
+
+
+class DecoderPlan:
+
+    def __init__(self, data_header, projection=None, allocator=None):
+        """
+        Compiled decoding instructions for one data header.
+        :param data_header: Parsed data header.
+        :param projection: Names of the channels to decode. Channels not in the projection get no reader (None)
+                           and are skipped by the handler. None decodes all channels.
+        :param allocator: Function (dtype, shape) -> array providing the arrays compressed values are unpacked into.
+        """
+        self.data_header = data_header
+        self.projection = projection
+        self.allocator = allocator
+
+        #TODO: Why do we need to pre-process the message? Source change?
+        for channel in data_header["channels"]:
+            # Define endianness of data
+            # > - big endian
+            # < - little endian (default)
+            channel["encoding"] = ">" if channel.get("encoding") == "big" else "<"
+
+        # Construct the channel definitions.
+        self.channels_definitions = [(channel["name"], channel["encoding"],
+                                      get_channel_reader(channel, allocator)
+                                      if projection is None or channel["name"] in projection else None)
+                                     for channel in data_header["channels"]]
+
+        # Uncompressed scalar channels with the same dtype are decoded together, with one np.frombuffer per group.
+        # scalar_groups: dtype of each group, channels_scalar_groups: group index per channel (None: not grouped).
+        self.scalar_groups = []
+        self.channels_scalar_groups = []
+
+        group_indexes = {}
+        for channel, (_name, _endianness, reader) in zip(data_header["channels"], self.channels_definitions):
+            dtype = get_scalar_dtype(channel) if reader is not None else None
+
+            if dtype is not None and dtype not in group_indexes:
+                group_indexes[dtype] = len(self.scalar_groups)
+                self.scalar_groups.append(np.dtype(dtype))
+
+            self.channels_scalar_groups.append(group_indexes.get(dtype))
+
+        # Whether the values of the channels are compressed - only those are worth decompressing in parallel.
+        self.channels_compressed = [compression_provider_mapping.get(channel.get("compression"),
+                                                                     NoCompression) is not NoCompression
+                                    for channel in data_header["channels"]]
+
+
+    @staticmethod
+    def from_bytes(data_header_bytes, dh_compression=None, projection=None, allocator=None):
+        """
+        Decompress and parse the data header and compile the plan.
+        :param data_header_bytes: Raw bytes of the data header.
+        :param dh_compression: Compression of the data header.
+        :param projection: Names of the channels to decode. None decodes all channels.
+        :param allocator: Function (dtype, shape) -> array providing the arrays compressed values are unpacked into.
+        :return: Decoder plan.
+        """
+        data_header = json_backend.loads(get_value_reader("string", dh_compression,
+                                                          value_name="data_header")(data_header_bytes))
+        return DecoderPlan(data_header, projection, allocator)
+
+
+
+class DecoderPlanCache:
+
+    def __init__(self, max_size=32):
+        """
+        LRU cache of decoder plans keyed by data header hash (and projection and allocator).
+        :param max_size: Maximum number of plans to keep.
+        """
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._plans = OrderedDict()
+        self._lock = Lock()
+
+
+    def get(self, data_header_hash, data_header_bytes, dh_compression=None, projection=None, allocator=None):
+        """
+        Get the decoder plan for the data header - the data header is only parsed if the plan is not cached yet.
+        :param data_header_hash: Hash of the data header (from the main header).
+        :param data_header_bytes: Raw bytes of the data header.
+        :param dh_compression: Compression of the data header.
+        :param projection: Frozenset of the channel names to decode. None decodes all channels.
+        :param allocator: Function (dtype, shape) -> array providing the arrays compressed values are unpacked into.
+                          Kept alive by the cached plan.
+        :return: Decoder plan.
+        """
+        key = (data_header_hash, projection, allocator)
+
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+
+            self.misses += 1
+
+        # Parse outside of the lock - in the worst case concurrent handlers compile the same plan twice.
+        plan = DecoderPlan.from_bytes(data_header_bytes, dh_compression, projection, allocator)
+
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+
+        return plan
+
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+    def __len__(self):
+        return len(self._plans)
+
+
+
+# Cache shared by all handler instances.
+decoder_plan_cache = DecoderPlanCache()
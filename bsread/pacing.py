@@ -0,0 +1,120 @@
+import time
+from collections import deque
+
+import numpy as np
+
+from .consts import CATCH_UP, SKIP
+
+overrun_policies = (CATCH_UP, SKIP)
+
+
+class Pacer:
+
+    def __init__(self, interval, overrun_policy=CATCH_UP, busy_wait=0.0, history_size=100000, clock=time.perf_counter,
+                 sleep=time.sleep):
+        """
+        Paces a loop to absolute deadlines (start + n * interval) - the time spent in the loop body does not add up
+        to a drift of the rate.
+        :param interval: Interval in seconds between iterations.
+        :param overrun_policy: What to do if the loop body took longer than the interval: CATCH_UP sends the missed
+                               iterations back to back until the schedule is reached again, SKIP drops the missed
+                               deadlines and continues at the next one. Without an interval (interval <= 0) there
+                               are no deadlines to skip and both policies run as fast as possible.
+        :param busy_wait: Time in seconds before the deadline from which on the pacer busy-waits instead of sleeping.
+                          Sleeping overshoots by up to a few 100 us - busy-waiting the last fraction of a millisecond
+                          reduces the jitter at the cost of a CPU core.
+        :param history_size: Number of inter-iteration intervals kept for the jitter statistics.
+        :param clock: Function returning the current time in seconds.
+        :param sleep: Function sleeping for the given number of seconds.
+        """
+        if overrun_policy not in overrun_policies:
+            raise ValueError(f'Overrun policy "{overrun_policy}" not supported. Available: {list(overrun_policies)}')
+
+        self.interval = interval
+        self.overrun_policy = overrun_policy
+        self.busy_wait = busy_wait
+        self.clock = clock
+        self.sleep = sleep
+
+        self.n_iterations = 0
+        self.n_skipped = 0
+
+        self.deadline = None
+        self.first_time = None
+        self.last_time = None
+        self.intervals = deque(maxlen=history_size)
+
+
+    def wait(self):
+        """
+        Wait for the next deadline. The first call returns immediately and starts the schedule.
+        """
+        now = self.clock()
+
+        if self.deadline is None:
+            self.deadline = now
+
+        elif now > self.deadline and self.overrun_policy == SKIP and self.interval > 0:
+            n_missed = int((now - self.deadline) // self.interval) + 1
+            self.deadline += n_missed * self.interval
+            self.n_skipped += n_missed
+
+        remaining = self.deadline - now
+        if remaining > self.busy_wait:
+            self.sleep(remaining - self.busy_wait)
+
+        while self.clock() < self.deadline:
+            pass
+
+        now = self.clock()
+
+        if self.last_time is None:
+            self.first_time = now
+        else:
+            self.intervals.append(now - self.last_time)
+
+        self.last_time = now
+        self.n_iterations += 1
+        self.deadline += self.interval
+
+
+    @property
+    def statistics(self):
+        return PacingStatistics(self.interval, self.n_iterations, self.n_skipped,
+                                (self.last_time - self.first_time) if self.n_iterations else 0.0,
+                                np.array(self.intervals))
+
+
+
+class PacingStatistics:
+
+    percentiles = (50, 90, 99, 99.9, 100)
+
+
+    def __init__(self, interval, n_iterations, n_skipped, duration, intervals):
+        """
+        :param interval: Target interval in seconds.
+        :param n_iterations: Number of paced iterations.
+        :param n_skipped: Number of skipped deadlines (SKIP overrun policy).
+        :param duration: Time in seconds between the first and the last iteration.
+        :param intervals: Array of the (most recent) intervals in seconds between iterations.
+        """
+        self.interval = interval
+        self.n_iterations = n_iterations
+        self.n_skipped = n_skipped
+        self.duration = duration
+
+        self.target_rate = 1 / interval if interval else float("inf")
+        self.rate = (n_iterations - 1) / duration if duration > 0 else 0.0
+
+        # Jitter: deviation of the interval between two iterations from the target interval.
+        jitter = np.abs(intervals - interval)
+        self.jitter_percentiles = dict(zip(self.percentiles, np.percentile(jitter, self.percentiles))) \
+            if jitter.size else {}
+
+
+    def __str__(self):
+        jitter = ", ".join(f"p{percentile}: {value * 1e6:.1f} us"
+                           for percentile, value in self.jitter_percentiles.items())
+        return f"n_messages: {self.n_iterations}, skipped: {self.n_skipped}, rate: {self.rate:.3f} Hz " \
+               f"(target {self.target_rate:.3f} Hz), jitter: [{jitter}]"
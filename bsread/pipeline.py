@@ -0,0 +1,255 @@
+import time
+from collections import deque
+from logging import getLogger
+from threading import Condition, Thread
+
+from .consts import BLOCK, DROP_OLDEST, DROP_NEWEST
+
+_logger = getLogger(__name__)
+
+
+overflow_policies = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class SendPipeline:
+
+    def __init__(self, encode_function, send_function, depth=10, overflow_policy=BLOCK):
+        """
+        Two stage pipeline - an encode stage turning messages into frames and an I/O stage sending the frames - each
+        running in its own thread.
+        :param encode_function: Function converting a message into its frames.
+        :param send_function: Function sending the frames of a message.
+        :param depth: Maximum number of messages waiting for encoding (and of encoded messages waiting for sending).
+        :param overflow_policy: What to do if a message is put into a full pipeline: BLOCK until there is space,
+                                DROP_OLDEST message waiting for encoding or DROP_NEWEST (the message put).
+        """
+        if overflow_policy not in overflow_policies:
+            raise ValueError(f'Overflow policy "{overflow_policy}" not supported. Available: {list(overflow_policies)}')
+
+        if depth < 1:
+            raise ValueError(f"Pipeline depth needs to be at least 1, not {depth}")
+
+        self.encode_function = encode_function
+        self.send_function = send_function
+        self.depth = depth
+        self.overflow_policy = overflow_policy
+
+        # Counters
+        self.n_received = 0  # Messages put into the pipeline.
+        self.n_dropped = 0  # Messages dropped because of the overflow policy.
+        self.n_sent = 0  # Messages sent.
+        self.n_failed = 0  # Messages which could not be encoded or sent.
+
+        self._messages = deque()  # Messages waiting for encoding.
+        self._frames = deque()  # Encoded messages waiting for sending.
+        self._condition = Condition()
+
+        self._running = False
+        self._encoding = False
+        self._aborted = False
+        self._send_stopped = False
+        self._on_stopped = None
+        self._threads = []
+
+
+    def start(self):
+        with self._condition:
+            self._running = True
+            self._encoding = True
+            self._aborted = False
+            self._send_stopped = False
+            self._on_stopped = None
+
+        self._threads = [Thread(target=self._encode_worker, name="bsread-encode", daemon=True),
+                         Thread(target=self._send_worker, name="bsread-send", daemon=True)]
+
+        for thread in self._threads:
+            thread.start()
+
+
+    def stop(self, timeout=None, on_stopped=None):
+        """
+        Stop accepting messages, send the messages already in the pipeline and stop the workers.
+        :param timeout: Timeout in seconds to send the messages in the pipeline - the messages not sent by then are
+                        dropped (a send in progress is not interrupted). None waits indefinitely.
+        :param on_stopped: Function called once the I/O worker stopped (e.g. to close the socket it sends on). Called
+                           before returning or, if a send in progress outlasts the timeout, by the I/O worker when
+                           the send returned.
+        :return: True if all messages were sent (or failed), False if messages were dropped.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        flushed = self.flush(timeout)
+
+        if not flushed:
+            with self._condition:
+                # Messages still being encoded are dropped by the encode worker.
+                self._aborted = True
+                n_dropped = len(self._messages) + len(self._frames)
+                self.n_dropped += n_dropped
+                self._messages.clear()
+                self._frames.clear()
+                self._condition.notify_all()
+
+            _logger.warning(f"Pipeline not sent within {timeout} seconds - dropped {n_dropped} messages.")
+
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0) if deadline is not None else None)
+
+            if thread.is_alive():
+                _logger.warning(f"Pipeline thread {thread.name} did not stop within {timeout} seconds.")
+
+        self._threads = []
+
+        if on_stopped is not None:
+            with self._condition:
+                send_stopped = self._send_stopped
+                if not send_stopped:
+                    self._on_stopped = on_stopped
+
+            if send_stopped:
+                on_stopped()
+
+        return flushed
+
+
+    def put(self, message):
+        """
+        Put a message into the pipeline.
+        :param message: Message to encode and send.
+        :return: False if the message was dropped, True otherwise.
+        """
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("Pipeline is not running")
+
+            self.n_received += 1
+
+            if len(self._messages) >= self.depth:
+                if self.overflow_policy == DROP_NEWEST:
+                    self.n_dropped += 1
+                    return False
+
+                elif self.overflow_policy == DROP_OLDEST:
+                    self._messages.popleft()
+                    self.n_dropped += 1
+
+                else:
+                    while len(self._messages) >= self.depth and self._running:
+                        self._condition.wait()
+
+                    # Stopped while waiting for space - the workers might not take messages anymore.
+                    if not self._running:
+                        self.n_dropped += 1
+                        self._condition.notify_all()
+                        return False
+
+            self._messages.append(message)
+            self._condition.notify_all()
+
+        return True
+
+
+    def flush(self, timeout=None):
+        """
+        Wait until all messages in the pipeline are sent (or failed).
+        :param timeout: Timeout in seconds - None waits indefinitely.
+        :return: True if the pipeline is empty, False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.n_pending == 0, timeout)
+
+
+    @property
+    def n_pending(self):
+        """
+        Number of messages in the pipeline - waiting for encoding, being encoded or waiting for sending.
+        """
+        return self.n_received - self.n_dropped - self.n_sent - self.n_failed
+
+
+    @property
+    def statistics(self):
+        with self._condition:
+            return {"received": self.n_received,
+                    "dropped": self.n_dropped,
+                    "sent": self.n_sent,
+                    "failed": self.n_failed,
+                    "waiting_encode": len(self._messages),
+                    "waiting_send": len(self._frames)}
+
+
+    def _encode_worker(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._messages or not self._running)
+
+                # Stopped and all messages encoded.
+                if not self._messages:
+                    self._encoding = False
+                    self._condition.notify_all()
+                    return
+
+                message = self._messages.popleft()
+                self._condition.notify_all()
+
+            try:
+                frames = self.encode_function(message)
+            except Exception:
+                _logger.exception("Unable to encode message.")
+                with self._condition:
+                    self.n_failed += 1
+                    self._condition.notify_all()
+                continue
+
+            with self._condition:
+                # The encode stage only runs ahead of the I/O stage by depth messages.
+                self._condition.wait_for(lambda: len(self._frames) < self.depth or self._aborted)
+
+                if self._aborted:
+                    self.n_dropped += 1
+                    self._condition.notify_all()
+                    continue
+
+                self._frames.append(frames)
+                self._condition.notify_all()
+
+
+    def _send_worker(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._frames or not self._encoding)
+
+                # Encode stage stopped and all messages sent.
+                if not self._frames:
+                    self._send_stopped = True
+                    on_stopped = self._on_stopped
+                    self._on_stopped = None
+                    break
+
+                frames = self._frames.popleft()
+                self._condition.notify_all()
+
+            try:
+                self.send_function(frames)
+                failed = False
+            except Exception:
+                _logger.exception("Unable to send message.")
+                failed = True
+
+            with self._condition:
+                if failed:
+                    self.n_failed += 1
+                else:
+                    self.n_sent += 1
+                self._condition.notify_all()
+
+        if on_stopped is not None:
+            try:
+                on_stopped()
+            except Exception:
+                _logger.exception("Error while stopping the pipeline.")
@@ -6,24 +6,108 @@ import struct
 import sys
 import time
 from collections import OrderedDict
-from threading import Lock
+from threading import Condition, Lock
+from types import MappingProxyType
 
 import mflow
+import numpy as np
+import zmq
 
-from .consts import BIND, CONNECT, PUSH, PUB
-from .data.helpers import get_channel_encoding, get_channel_specs, get_value_bytes
+from .consts import BIND, BLOCK, CATCH_UP, CONNECT, PUSH, PUB
+from .data import json_backend
+from .data.helpers import get_channel_encoding, get_channel_specs, get_value_encoder, get_value_fingerprint
+from .data.compression import BitshuffleLZ4, NoCompression
 from .data.serialization import compression_provider_mapping
+from .pacing import Pacer
+from .pipeline import SendPipeline, overflow_policies
 
 
 printable_compression_provider_mapping = list(compression_provider_mapping.keys())
 
 
+# Timestamp frames: seconds and nanoseconds as int64, in the byte order of the channel.
+_timestamp_structs = {"<": struct.Struct("<qq"),
+                      ">": struct.Struct(">qq")}
+
+
+def _get_channel_timestamps(channel_timestamps, n_channels):
+    channel_timestamps = np.asarray(channel_timestamps)
+
+    # Seconds as floats - split into seconds and nanoseconds, as for the global timestamp.
+    if channel_timestamps.ndim == 1:
+        nanoseconds, seconds = np.modf(channel_timestamps)
+        channel_timestamps = np.stack([seconds, nanoseconds * 1e9], axis=1)
+
+    if channel_timestamps.shape != (n_channels, 2):
+        raise ValueError(f"Shape of channel timestamps {channel_timestamps.shape} does not correspond to configured "
+                         f"channels ({n_channels}, 2)")
+
+    return channel_timestamps
+
+
+def _call_timed(function, *args):
+    # Module level (picklable) to be usable with process pools.
+    start_time = time.perf_counter()
+    value = function(*args)
+    return value, time.perf_counter() - start_time
+
+
+def _get_main_header_template(main_header):
+    # Only pulse_id and global timestamp change from message to message - encode the rest once, with
+    # placeholders that are replaced by the integer values on send.
+    main_header = dict(main_header)
+    main_header["pulse_id"] = "__pulse_id__"
+    main_header["global_timestamp"] = {"sec": "__sec__", "ns": "__ns__"}
+
+    return json_backend.dumps(main_header) \
+        .replace(b"%", b"%%") \
+        .replace(b'"__pulse_id__"', b"%d") \
+        .replace(b'"__sec__"', b"%d") \
+        .replace(b'"__ns__"', b"%d")
+
+
 class Sender:
 
     def __init__(self, queue_size=10, port=9999, address="tcp://*", conn_type=BIND, mode=PUSH, block=True,
                  start_pulse_id=0, data_header_compression=None, send_timeout=None, data_compression=None,
-                 copy=True):
+                 copy=True, compression_executor=None, parallel_threshold=65536, pipeline_depth=None,
+                 overflow_policy=BLOCK, function_executor=None, block_size_calibration=None, close_timeout=10.0,
+                 function_statistics=False):
+        """
+        :param compression_executor: Executor (e.g. concurrent.futures.ThreadPoolExecutor) used to compress large
+                                     channel values of a message concurrently. None compresses all values inline.
+                                     The executor is not shut down by the sender.
+        :param parallel_threshold: Minimum size in bytes of an array to be compressed by the executor.
+        :param pipeline_depth: If set, send() only captures the values of the message and an encode and an I/O
+                               thread encode and send it. Maximum number of messages waiting in each stage.
+                               None encodes and sends inline.
+        :param overflow_policy: Pipeline overflow policy - BLOCK, DROP_OLDEST or DROP_NEWEST.
+        :param close_timeout: Timeout in seconds to send the messages still in the pipeline on close. Messages not
+                              sent by then are dropped. None waits indefinitely (a blocking send without
+                              send_timeout might then block close forever).
+        :param function_executor: Executor used to call the channel functions of a pulse concurrently. With a
+                                  ProcessPoolExecutor the channel functions and their values need to be picklable.
+                                  None calls the functions one after the other. The executor is not shut down by
+                                  the sender.
+        :param function_statistics: Whether to record the time spent in each channel function (in
+                                    function_statistics).
+        :param block_size_calibration: BlockSizeCalibration (bsread.calibration) calibrating the compression block
+                                       size of the channels with bitshuffle compression. None uses the default block
+                                       size.
+        """
         self.copy = copy
+        self.compression_executor = compression_executor
+        self.function_executor = function_executor
+        self.parallel_threshold = parallel_threshold
+        self.block_size_calibration = block_size_calibration
+
+        if overflow_policy not in overflow_policies:
+            raise ValueError(f'Overflow policy "{overflow_policy}" not supported. Available: {list(overflow_policies)}')
+
+        self.pipeline_depth = pipeline_depth
+        self.overflow_policy = overflow_policy
+        self.close_timeout = close_timeout
+        self.pipeline = None
         self.block = block
         self.queue_size = queue_size
         self.port = port
@@ -37,18 +121,27 @@ class Sender:
         self.start_pulse_id = start_pulse_id
         self.pulse_id = None
 
-        self.channels = OrderedDict()
-
         # Ability to add a pre and/or post function
         self.pre_function = None
         self.post_function = None
 
-        # Internal state
-        self.data_header = None
-        self.data_header_bytes = None
-        self.main_header = None
+        # Internal state - channels and headers are an immutable snapshot, replaced as a whole on changes.
+        self.configuration = ChannelConfiguration(OrderedDict())
+
+        # Timing of the channel functions (of the current configuration) - only recorded if enabled.
+        self.record_function_statistics = function_statistics
+        self.function_statistics = None
 
+        # Serializes configuration changes (sends do not take it), the pulse id assignment and the access to the
+        # socket.
         self.channels_lock = Lock()
+        self.pulse_lock = Lock()
+        self.send_lock = Lock()
+
+        # Sends with automatic pulse id deliver their messages in turns, in the order the pulse ids were assigned.
+        self.pulse_turn_condition = Condition(self.pulse_lock)
+        self.n_pulse_turns = 0
+        self.pulse_turn = 0
 
         # Raise exception if invalid compression is used.
         if data_header_compression not in compression_provider_mapping:
@@ -75,51 +168,146 @@ class Sender:
         if "compression" not in metadata and self.data_compression is not None:
             metadata["compression"] = self.data_compression
 
-        # Add channel
+        # Add channel - to a copy of the channels, sends in progress keep using the current configuration.
         with self.channels_lock:
-            self.channels[name] = Channel(function, metadata)
+            channels = OrderedDict(self.configuration.channels)
+            channels[name] = Channel(function, metadata)
 
-            # If the stream is already open, recreate the header.
-            if self.status_stream_open:
-                self._create_data_header()
+            self._update_configuration(channels)
 
 
     def open(self, no_client_action=None, no_client_timeout=None):
         self.stream = mflow.connect(f"{self.address}:{self.port}", queue_size=self.queue_size,
                                     conn_type=self.conn_type, mode=self.mode, no_client_action=no_client_action,
                                     no_client_timeout=no_client_timeout, copy=self.copy, send_timeout=self.send_timeout)
-        # Main header
-        self.main_header = {}
-        self.main_header["htype"] = "bsr_m-1.1"
-        if self.data_header_compression:
-            self.main_header["dh_compression"] = self.data_header_compression
-
-        # Data header
+        # Main and data header
         with self.channels_lock:
-            self._create_data_header()
+            self._update_configuration(self.configuration.channels, self.configuration.data_fingerprint,
+                                       create_headers=True)
 
         # Set initial pulse_id
         self.pulse_id = self.start_pulse_id
 
+        if self.pipeline_depth is not None:
+            self.pipeline = SendPipeline(self._encode_pipeline_message, self._send_frames, self.pipeline_depth,
+                                         self.overflow_policy)
+            self.pipeline.start()
+
         # Update internal status
         self.status_stream_open = True
 
 
-    def _create_data_header(self):
-        self.data_header = {}
-        self.data_header["htype"] = "bsr_d-1.1"
-        self.data_header["channels"] = [channel.metadata for channel in self.channels.values()]
+    def _get_channel_encoder(self, metadata):
+        """
+        Compile the value encoder of a channel - calibrating the compression block size if enabled.
+        :param metadata: Channel metadata.
+        :return: Value encoder.
+        """
+        def get_encoder(block_size=None):
+            return get_value_encoder(metadata.get("type"), metadata.get("compression"), copy_arrays=not self.copy,
+                                     block_size=block_size)
+
+        # Only arrays of a known type are compressed with the block size.
+        if self.block_size_calibration is not None and metadata.get("type") is not None \
+                and issubclass(compression_provider_mapping[metadata.get("compression")], BitshuffleLZ4):
+            return self.block_size_calibration.get_encoder(metadata, get_encoder)
+
+        return get_encoder()
+
+
+    def _update_configuration(self, channels, data_fingerprint=None, create_headers=None):
+        """
+        Compile a new configuration snapshot and make it the current one. Needs to be called with the channels_lock
+        held.
+        :param channels: Ordered dictionary of channel name -> Channel.
+        :param data_fingerprint: Fingerprint of the data the channels were derived from (check_data=True).
+        :param create_headers: Whether to create the headers - by default only if the stream is open.
+        :return: New configuration.
+        """
+        if create_headers is None:
+            create_headers = self.status_stream_open
+
+        # Compile the value encoders of new channels. If zmq copies the frames anyway, arrays are passed as they are.
+        # Channels are shared between snapshots and not modified once compiled.
+        for channel in channels.values():
+            if channel.encoder is None:
+                channel.encoder = self._get_channel_encoder(channel.metadata)
+                channel.endianness = ">" if channel.metadata.get("encoding") == "big" else "<"
+                channel.compressed = compression_provider_mapping[channel.metadata.get("compression")] \
+                    is not NoCompression
+
+        data_header = None
+        data_header_bytes = None
+        main_header = None
+        main_header_template = None
+
+        if create_headers:
+            data_header = {}
+            data_header["htype"] = "bsr_d-1.1"
+            data_header["channels"] = [channel.metadata for channel in channels.values()]
+
+            # Encoded with the standard library, independent of the JSON backend - the same bytes (and hash) as
+            # before the backends were introduced. Only done on configuration changes.
+            data_header_bytes = np.frombuffer(json.dumps(data_header).encode("utf-8"), dtype=np.uint8)
+            data_header_bytes = compression_provider_mapping[self.data_header_compression].pack_data(
+                data_header_bytes, "u1")
+
+            main_header = {}
+            main_header["htype"] = "bsr_m-1.1"
+            if self.data_header_compression:
+                main_header["dh_compression"] = self.data_header_compression
+            main_header["hash"] = hashlib.md5(data_header_bytes).hexdigest()
 
-        self.data_header_bytes = get_value_bytes(json.dumps(self.data_header), self.data_header_compression)
-        self.main_header["hash"] = hashlib.md5(self.data_header_bytes).hexdigest()
+            main_header_template = _get_main_header_template(main_header)
+
+        # Swapped with a single assignment - a send uses either the old or the new configuration.
+        self.configuration = ChannelConfiguration(channels, data_header, data_header_bytes, main_header,
+                                                  main_header_template, data_fingerprint)
+        return self.configuration
+
+
+    @property
+    def channels(self):
+        # Read-only view - channels are changed with add_channel, which replaces the configuration.
+        return MappingProxyType(self.configuration.channels)
+
+
+    @property
+    def data_header(self):
+        return self.configuration.data_header
+
+
+    @property
+    def data_header_bytes(self):
+        return self.configuration.data_header_bytes
+
+
+    @property
+    def main_header(self):
+        return self.configuration.main_header
 
 
     def close(self):
-        self.stream.disconnect()
+        # Send the messages still in the pipeline. The socket is only closed once the I/O thread stopped sending on it -
+        # if a send outlasts the close timeout, the I/O thread closes it when the send returned.
+        if self.pipeline is not None:
+            self.pipeline.stop(self.close_timeout, on_stopped=self.stream.disconnect)
+            self.pipeline = None
+        else:
+            self.stream.disconnect()
+
         self.status_stream_open = False
 
 
     def add_channel_from_value(self, name, value):
+        with self.channels_lock:
+            channels = OrderedDict(self.configuration.channels)
+            channels[name] = self._get_channel_from_value(name, value)
+
+            self._update_configuration(channels)
+
+
+    def _get_channel_from_value(self, name, value):
         metadata = {}
 
         metadata["name"] = name
@@ -129,14 +317,20 @@ class Sender:
         if self.data_compression is not None:
             metadata["compression"] = self.data_compression
 
-        self.channels[name] = Channel(None, metadata)
+        return Channel(None, metadata)
 
 
-    def send(self, *args, timestamp=None, pulse_id=None, data=None, check_data=True,  **kwargs):
+    def send(self, *args, timestamp=None, pulse_id=None, data=None, check_data=True, channel_timestamps=None,
+             **kwargs):
         """
             data:       Data to be send with the message send. If no data is specified data will be retrieved from the
                         functions registered with each channel
             interval:   Interval in seconds to repeatedly execute this method
+            channel_timestamps: Individual timestamps of the channels (in channel order) - either a numpy array of
+                        shape (n_channels, 2) holding seconds and nanoseconds, or of shape (n_channels,) holding
+                        seconds as floats. By default all channels get the global timestamp.
+            Messages of concurrent sends with automatic pulse id (no pulse_id given) leave in pulse id order - the
+            channel functions and the encoding of concurrent sends still run in parallel.
         """
         if timestamp is None:
             timestamp = time.time()
@@ -154,101 +348,300 @@ class Sender:
         list_data = args if args else None
         dict_data = data if data else kwargs  # data has precedence before **kwargs
 
-        if pulse_id is not None:
-            self.pulse_id = pulse_id
+        pipeline = self.pipeline
+
+        if pulse_id is None:
+            # Only the pulse id assignment and the delivery of the message are serialized - the message is prepared
+            # outside the lock and sent (or queued) on its turn, so messages of concurrent sends leave in pulse id
+            # order.
+            with self.pulse_lock:
+                pulse_id = self.pulse_id
+                self.pulse_id += 1
+                turn = self.n_pulse_turns
+                self.n_pulse_turns += 1
+
+            message = None
+            try:
+                message = self._prepare_message(pipeline, pulse_id, current_timestamp_epoch, current_timestamp_ns,
+                                                list_data, dict_data, check_data, channel_timestamps)
+            finally:
+                # A failed send still passes on its turn.
+                with self.pulse_turn_condition:
+                    self.pulse_turn_condition.wait_for(lambda: self.pulse_turn == turn)
+                    try:
+                        if message is not None:
+                            self._deliver_message(pipeline, message)
+                    finally:
+                        self.pulse_turn += 1
+                        self.pulse_turn_condition.notify_all()
+        else:
+            message = self._prepare_message(pipeline, pulse_id, current_timestamp_epoch, current_timestamp_ns,
+                                            list_data, dict_data, check_data, channel_timestamps)
+            self._deliver_message(pipeline, message)
+            with self.pulse_lock:
+                self.pulse_id = pulse_id + 1
+
+        # Call post function if registered
+        if self.post_function:
+            self.post_function()
 
-        # Lock the channel while sending data - prevent data corruption.
-        with self.channels_lock:
 
-            if check_data:
-                logging.debug("Update channel metadata.")
+    def _prepare_message(self, pipeline, pulse_id, current_timestamp_epoch, current_timestamp_ns, list_data,
+                         dict_data, check_data, channel_timestamps):
+        """
+        Prepare a message for delivery - produce its values (if no data is given) and encode it, or, with pipeline,
+        capture its values for encoding in the pipeline.
+        :return: Frames of the message, or the message to put into the pipeline.
+        """
+        # Same order with and without pipeline: channel metadata update, pre function, channel functions.
+        configuration = self.configuration
+        produce_values = not dict_data and not list_data
 
-                if dict_data:
+        # The channel metadata (and data header) is only rebuilt if the type, shape or encoding of the data changed.
+        if check_data and not produce_values:
+            configuration = self._get_data_configuration(configuration, list_data, dict_data)
 
-                    self.channels = OrderedDict()
+        # Call pre function if registered
+        if self.pre_function:
+            self.pre_function()
 
-                    for name, value in dict_data.items():
-                        self.add_channel_from_value(name, value)
+        if produce_values:
+            # Values of the current pulse are produced by the channel functions - the message is encoded with the
+            # configuration the values were produced with.
+            configuration = self.configuration
+            list_data = self._produce_values(configuration, pulse_id)
 
-                    self._create_data_header()
+        if pipeline is None:
+            return self._encode_message(pulse_id, current_timestamp_epoch, current_timestamp_ns,
+                                        list_data, dict_data, channel_timestamps, configuration)
 
-                elif list_data:
-                    n_list_data = len(list_data)
-                    n_channels = len(self.channels)
-                    if n_list_data != n_channels:
-                        raise ValueError(f"Length of passed data ({n_list_data}) does not correspond to configured channels ({n_channels})")
+        if dict_data:
+            # The values themselves are not copied - they must not be modified after sending.
+            dict_data = dict(dict_data)
+
+        return (pulse_id, current_timestamp_epoch, current_timestamp_ns,
+                list_data, dict_data, channel_timestamps, configuration)
+
+
+    def _deliver_message(self, pipeline, message):
+        if pipeline is None:
+            self._send_frames(message)
+        else:
+            pipeline.put(message)
+
+
+    def _produce_values(self, configuration, pulse_id):
+        """
+        Call the functions of the channels - concurrently if a function executor is set - and record their time (if
+        enabled).
+        :return: List of values in channel order.
+        """
+        channels = configuration.channels.values()
+
+        if not self.record_function_statistics:
+            if self.function_executor is None:
+                return [channel.function(pulse_id) for channel in channels]
+
+            futures = [self.function_executor.submit(channel.function, pulse_id) for channel in channels]
+            return [future.result() for future in futures]
 
-                    # channels is Ordered dict, assumption is that channels are in the same order
-                    for index, name in enumerate(self.channels):
-                        self.add_channel_from_value(name, list_data[index])
+        if self.function_executor is None:
+            values = []
+            times = []
 
-                    self._create_data_header()
+            for channel in channels:
+                start_time = time.perf_counter()
+                values.append(channel.function(pulse_id))
+                times.append(time.perf_counter() - start_time)
 
-            # Call pre function if registered
-            if self.pre_function:
-                self.pre_function()
+        else:
+            futures = [self.function_executor.submit(_call_timed, channel.function, pulse_id) for channel in channels]
+            values, times = zip(*[future.result() for future in futures]) if futures else ((), ())
+
+        # Statistics are kept per configuration - a new configuration starts new statistics.
+        function_statistics = self.function_statistics
+        if function_statistics is None or function_statistics.configuration is not configuration:
+            function_statistics = ChannelFunctionStatistics(configuration)
+            self.function_statistics = function_statistics
 
-            self.main_header["pulse_id"] = self.pulse_id
-            self.main_header["global_timestamp"] = {"sec": current_timestamp_epoch, "ns": current_timestamp_ns}
+        function_statistics.add(times)
 
-            # Send headers
-            # Main header
-            self.stream.send(json.dumps(self.main_header).encode("utf-8"), send_more=True, block=self.block)
-            # Data header
-            self.stream.send(self.data_header_bytes, send_more=True, block=self.block)
+        return list(values)
 
-            counter = 0
-            count = len(self.channels) - 1  # use of count to make value timestamps unique and to detect last item
-            for name, channel in self.channels.items():
-                if dict_data:
-                    value = dict_data[name]
-                elif list_data:
-                    value = list_data[counter]
+
+    def _encode_message(self, pulse_id, current_timestamp_epoch, current_timestamp_ns, list_data, dict_data,
+                        channel_timestamps, configuration):
+        """
+        Encode a message into its frames.
+        :param configuration: Channel configuration to encode the message with (corresponding to the data).
+        :return: List of frames - main header, data header and a value and timestamp frame per channel.
+        """
+        # Exactly int - %d would turn bools (and int subclasses in general) into numbers.
+        if type(pulse_id) is int and type(current_timestamp_epoch) is int and type(current_timestamp_ns) is int:
+            main_header_bytes = configuration.main_header_template % (pulse_id, current_timestamp_epoch,
+                                                                      current_timestamp_ns)
+        else:
+            # Values that cannot be spliced into the template (e.g. user provided float timestamps).
+            main_header = dict(configuration.main_header, pulse_id=pulse_id,
+                               global_timestamp={"sec": current_timestamp_epoch, "ns": current_timestamp_ns})
+            main_header_bytes = json_backend.dumps(main_header)
+
+        # Assemble all frames of the message - main header, data header and a value and timestamp frame per
+        # channel - and hand them to zmq at once.
+        frames = [main_header_bytes, configuration.data_header_bytes]
+
+        if channel_timestamps is None:
+            # All channels share the global timestamp - pack the timestamp frame once per byte order.
+            timestamp_frames = {endianness: timestamp_struct.pack(current_timestamp_epoch, current_timestamp_ns)
+                                for endianness, timestamp_struct in _timestamp_structs.items()}
+        else:
+            # Pack the timestamps of all channels at once per byte order, each channel gets its 16 bytes.
+            channel_timestamps = _get_channel_timestamps(channel_timestamps, len(configuration.channels))
+            channel_timestamps_bytes = {endianness: channel_timestamps.astype(endianness + "i8").tobytes()
+                                        for endianness in _timestamp_structs}
+
+        # Large compressed values are compressed by the executor - frame index and future, resolved before
+        # sending to keep the frame order.
+        pending_frames = []
+        executor = self.compression_executor
+
+        counter = 0
+        for name, channel in configuration.channels.items():
+            if dict_data:
+                value = dict_data[name]
+            else:
+                value = list_data[counter]
+
+            if value is None:
+                frames.append(b"")
+                frames.append(b"")
+            else:
+                if executor is not None and channel.compressed and isinstance(value, np.ndarray) \
+                        and value.nbytes >= self.parallel_threshold:
+                    pending_frames.append((len(frames), executor.submit(channel.encoder, value)))
+                    frames.append(None)
                 else:
-                    value = channel.function(self.pulse_id)
+                    frames.append(channel.encoder(value))
 
-                if value is None:
-                    self.stream.send(b"", send_more=True, block=self.block)
-                    self.stream.send(b"", send_more=(count > 0), block=self.block)
+                if channel_timestamps is None:
+                    frames.append(timestamp_frames[channel.endianness])
                 else:
-                    self.stream.send(get_value_bytes(value, channel.metadata.get("compression"),
-                                                     channel_type=channel.metadata.get("type")),
-                                     send_more=True, block=self.block)
+                    frames.append(channel_timestamps_bytes[channel.endianness][counter * 16:(counter + 1) * 16])
+            counter += 1
 
-                    endianness = ">" if channel.metadata.get("encoding") == "big" else "<"
+        for index, future in pending_frames:
+            frames[index] = future.result()
 
-                    #TODO: timestamps should be individual per channel
-                    self.stream.send(struct.pack(endianness + "q",
-                                                 current_timestamp_epoch) +
-                                     struct.pack(endianness + "q",
-                                                 current_timestamp_ns), send_more=(count > 0), block=self.block)
-                count -= 1
-                counter += 1
+        return frames
 
-        self.pulse_id += 1
 
-        # Call post function if registered
-        if self.post_function:
-            self.post_function()
+    def _get_data_configuration(self, configuration, list_data, dict_data):
+        """
+        Check the type, shape and encoding of the data against the channels of the configuration.
+        :param configuration: Current channel configuration.
+        :return: Configuration to encode the data with - a new one if the data does not correspond to the channels.
+        """
+        if dict_data:
+            fingerprint = tuple((name, get_value_fingerprint(value)) for name, value in dict_data.items())
+
+            if fingerprint != configuration.data_fingerprint:
+                with self.channels_lock:
+                    # The configuration might have been replaced (e.g. by add_channel) since it was read.
+                    configuration = self.configuration
+
+                    if fingerprint != configuration.data_fingerprint:
+                        logging.debug("Update channel metadata.")
+
+                        channels = OrderedDict((name, self._get_channel_from_value(name, value))
+                                               for name, value in dict_data.items())
+                        configuration = self._update_configuration(channels, fingerprint)
+
+        elif list_data:
+            value_fingerprints = [get_value_fingerprint(value) for value in list_data]
+            fingerprint = tuple(zip(configuration.channels, value_fingerprints))
+
+            if len(list_data) != len(configuration.channels) or fingerprint != configuration.data_fingerprint:
+                with self.channels_lock:
+                    # The configuration might have been replaced (e.g. by add_channel) since it was read.
+                    configuration = self.configuration
+
+                    n_list_data = len(list_data)
+                    n_channels = len(configuration.channels)
+                    if n_list_data != n_channels:
+                        raise ValueError(f"Length of passed data ({n_list_data}) does not correspond to configured channels ({n_channels})")
+
+                    fingerprint = tuple(zip(configuration.channels, value_fingerprints))
+
+                    if fingerprint != configuration.data_fingerprint:
+                        logging.debug("Update channel metadata.")
+
+                        # channels is Ordered dict, assumption is that channels are in the same order
+                        channels = OrderedDict((name, self._get_channel_from_value(name, value))
+                                               for name, value in zip(configuration.channels, list_data))
+                        configuration = self._update_configuration(channels, fingerprint)
+
+        return configuration
+
+
+    def _encode_pipeline_message(self, message):
+        return self._encode_message(*message)
+
 
+    def _send_frames(self, frames):
+        # Flags as plain ints - combining the zmq flag enums per frame (as socket.send_multipart does) is
+        # more expensive than the actual send of small frames.
+        flags = 0 if self.block else int(zmq.NOBLOCK)
+        more_flags = flags | int(zmq.SNDMORE)
 
-    def generate_stream(self, n_messages=None, interval=0.01):
+        send = self.stream.socket.send
+        copy = self.copy
+        track = not self.copy
+
+        try:
+            # zmq delivers multipart messages atomically - if the queue is full in non blocking mode the first
+            # frame fails and the whole message is dropped.
+            with self.send_lock:
+                for frame in frames[:-1]:
+                    send(frame, more_flags, copy=copy, track=track)
+                send(frames[-1], flags, copy=copy, track=track)
+        except zmq.Again:
+            if self.block:
+                raise
+        except zmq.ZMQError:
+            logging.exception("Error while sending")
+            raise
+
+
+    def generate_stream(self, n_messages=None, interval=0.01, overrun_policy=CATCH_UP, busy_wait=0.0):
         """
-        Send a continues stream of data.
+        Send a continues stream of data. Messages are sent at absolute deadlines (start + n * interval), the send
+        time does not reduce the rate.
         :param n_messages: Number of messages to send. None or negative number -> Send until interrupted.
         :param interval: Interval in seconds between messages.
-        :return:
+        :param overrun_policy: If sending took longer than the interval: CATCH_UP sends the missed messages back to
+                               back, SKIP drops the missed deadlines.
+        :param busy_wait: Time in seconds before each deadline to busy-wait instead of sleeping (lower jitter).
+        :return: Pacing statistics - achieved rate and jitter percentiles.
         """
+        pacer = Pacer(interval, overrun_policy=overrun_policy, busy_wait=busy_wait)
+
         with self:
             # Negative numbers will loop indefinitely.
             if not n_messages:
                 n_messages = -1
 
-            while n_messages != 0:
-                self.send()
-                time.sleep(interval)
+            try:
+                while n_messages != 0:
+                    pacer.wait()
+                    self.send()
 
-                n_messages -= 1
+                    n_messages -= 1
+
+            finally:
+                statistics = pacer.statistics
+                logging.info(f"Stream generation statistics: {statistics}")
+
+        return statistics
 
 
     # Support the "with" statement
@@ -262,12 +655,86 @@ class Sender:
 
 
 
+class ChannelConfiguration:
+
+    def __init__(self, channels, data_header=None, data_header_bytes=None, main_header=None,
+                 main_header_template=None, data_fingerprint=None):
+        """
+        Immutable snapshot of the channels of a sender, with the headers derived from them. Configuration changes
+        create a new snapshot - a send uses the snapshot current at its start, without locking.
+        :param channels: Ordered dictionary of channel name -> Channel (with compiled encoder). Must not be modified.
+        :param data_header: Data header, None if the stream is not open yet.
+        :param data_header_bytes: Encoded (and compressed) data header.
+        :param main_header: Main header without pulse_id and global timestamp.
+        :param main_header_template: Encoded main header with %d placeholders for pulse_id, sec and ns.
+        :param data_fingerprint: Fingerprint of the data the channels were derived from (check_data=True).
+        """
+        self.channels = channels
+        self.data_header = data_header
+        self.data_header_bytes = data_header_bytes
+        self.main_header = main_header
+        self.main_header_template = main_header_template
+        self.data_fingerprint = data_fingerprint
+
+
+
+class ChannelFunctionStatistics:
+
+    def __init__(self, configuration):
+        """
+        Time spent in the channel functions, per channel.
+        :param configuration: Channel configuration the functions belong to.
+        """
+        self.configuration = configuration
+        self.names = list(configuration.channels)
+
+        self.n_calls = 0
+        self.total_time = np.zeros(len(self.names))
+        self.max_time = np.zeros(len(self.names))
+        self.last_time = np.zeros(len(self.names))
+
+
+    def add(self, times):
+        """
+        :param times: Time in seconds spent in the function of each channel (in channel order) for one pulse.
+        """
+        self.last_time = np.array(times, dtype=float)
+        self.total_time += self.last_time
+        np.maximum(self.max_time, self.last_time, out=self.max_time)
+        self.n_calls += 1
+
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.n_calls if self.n_calls else np.zeros(len(self.names))
+
+
+    def get_slowest(self, n=5):
+        """
+        :param n: Number of channels to return.
+        :return: List of (channel name, mean time in seconds) of the n channels with the highest mean time.
+        """
+        mean_time = self.mean_time
+        return [(self.names[index], mean_time[index]) for index in np.argsort(mean_time)[::-1][:n]]
+
+
+    def __str__(self):
+        return "\n".join(f"{name}: mean {self.mean_time[index] * 1e6:.1f} us, max {self.max_time[index] * 1e6:.1f} us"
+                         for index, name in enumerate(self.names))
+
+
+
 class Channel:
 
     def __init__(self, function, metadata):
         self.function = function
         self.metadata = metadata
 
+        # Value encoder, byte order (< or >) and whether values are compressed - set by the sender when the data header is created.
+        self.encoder = None
+        self.endianness = None
+        self.compressed = False
+
         # metadata needs to contain: name, type (default: float64), encoding (default: little), shape (default [1])
         if "encoding" not in self.metadata:
             self.metadata["encoding"] = sys.byteorder
@@ -1,9 +1,10 @@
 import json
+import time
 
 import mflow
 
 from .consts import CONNECT, PULL, SUB, DEFAULT_DISPATCHER_URL
-from .handlers.compact import Handler
+from .handlers.compact import Handler, MessageBatch
 
 
 class Source:
@@ -11,7 +12,8 @@ class Source:
     def __init__(self, host=None, port=9999, config_port=None, conn_type=CONNECT, mode=None, queue_size=100,
                  copy=True, channels=None, config_address=None, all_channels=False, receive_timeout=None,
                  dispatcher_url=DEFAULT_DISPATCHER_URL, dispatcher_verify_request=True,
-                 dispatcher_disable_compression=False):
+                 dispatcher_disable_compression=False, lazy=False, projection=None,
+                 decompression_executor=None, buffer_pool=None):
         """
 
         Args:
@@ -23,6 +25,9 @@ class Source:
                             connect to the source or whether the source connects to this instance - values: CONNECT
                             or BIND
             mode:           Data delivery mode - values: PULL or PUB
+            copy:           If False, frames are received without copying them (zero-copy). Decoded (uncompressed)
+                            arrays then directly reference the zmq frame buffer and keep it alive as long as they
+                            are used. Recommended for large waveforms and images.
             channels:       List of channels that should be in the stream. This is either a list of channel names and/or
                             a list of dictionaries specifying the desired channel configuration.
                             Example: ['ChannelA', {'name': 'ChannelC', 'modulo': 10},
@@ -36,6 +41,17 @@ class Source:
                             set.
             dispatcher_url: URL of the dispatcher api
             receive_timeout:Receive timeout in milliseconds (-1 infinite)
+            lazy:           If True, channel values are only decompressed and deserialized when they are accessed for
+                            the first time. Saves CPU if only a few of the received channels are used.
+            projection:     List of channel names to decode. The data of all other channels in the stream is dropped
+                            without decoding and the channels are not part of the received messages. This is useful
+                            for direct connections (host parameter) to sources streaming more channels than needed.
+            decompression_executor: Executor (e.g. concurrent.futures.ThreadPoolExecutor) used to decompress large
+                            compressed channels of a message concurrently. The executor is not shut down by the
+                            source.
+            buffer_pool:    BufferPool (bsread.data.buffer_pool) compressed channels are decompressed into. Arrays are
+                            recycled once the received message is released (message.data.release() or using the
+                            message data in a "with" statement) - instead of allocating new arrays for every message.
         """
         self.use_dispatching_layer = False
 
@@ -113,12 +129,14 @@ class Source:
             # make sure that the connect statement is issued very quick
 
         self.stream = None
-        self.handler = Handler()
+        self.handler = Handler(lazy=lazy, projection=projection, executor=decompression_executor,
+                               buffer_pool=buffer_pool)
 
 
     def connect(self):
         self.stream = mflow.connect(self.address, conn_type=self.conn_type, queue_size=self.queue_size, mode=self.mode,
                                     copy=self.copy, receive_timeout=self.receive_timeout)
+
         return self  # Return self to be backward compatible
 
 
@@ -137,7 +155,23 @@ class Source:
                 dispatcher.remove_stream(self.address)
 
 
-    def receive(self, filter=None, handler=None):
+    def receive(self, filter=None, handler=None, header_filter=None):
+        """
+        Receive the next message.
+        :param filter: Function evaluated on the received message - messages for which it returns False are skipped.
+        :param handler: Handler to decode the message with - default: compact handler of this source.
+        :param header_filter: Function evaluated on the message right after its main header was parsed (only
+                              pulse_id, global_timestamp, global_timestamp_offset and hash are set). Messages for
+                              which it returns False are skipped without decoding their data. Only supported with
+                              the default handler.
+        :return: Received message, None on receive timeout.
+        """
+        if header_filter:
+            if handler:
+                raise ValueError("header_filter is only supported with the default handler")
+
+            handler = lambda receiver: self.handler.receive(receiver, header_filter=header_filter)
+
         if not handler:
             handler = self.handler.receive
 
@@ -153,6 +187,48 @@ class Source:
             return message
 
 
+    def receive_batch(self, n, timeout=None):
+        """
+        Receive up to n messages and return them as columns.
+        :param n: Maximum number of messages to receive.
+        :param timeout: Time in milliseconds after which the batch is returned, even if it holds less than n
+                        messages. None waits for n messages (or until the receive_timeout of the source expires).
+        :return: MessageBatch with one row per received message.
+        """
+        batch = MessageBatch(n)
+
+        socket = self.stream.socket
+        receive_timeout = socket.RCVTIMEO
+        deadline = time.time() + timeout / 1000 if timeout is not None else None
+
+        while len(batch) < n:
+            if deadline is not None:
+                remaining = int((deadline - time.time()) * 1000)
+                if remaining <= 0:
+                    break
+            else:
+                remaining = receive_timeout if receive_timeout >= 0 else None
+
+            # Wait for the next message - the batch ends on timeout.
+            if not socket.poll(remaining):
+                if deadline is None:
+                    break
+                continue
+
+            message = self.stream.receive(handler=self.handler.receive)
+
+            # Message that could not be decoded - skipped.
+            if message is None:
+                continue
+
+            batch.add(message.data)
+            # The values are copied into the batch.
+            message.data.release()
+
+        batch.truncate()
+        return batch
+
+
     # Support the "with" statement
 
     def __enter__(self):
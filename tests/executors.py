@@ -0,0 +1,14 @@
+class CountingExecutor:
+
+    def __init__(self, executor):
+        """
+        Executor recording the arguments of the submitted calls and passing them on to another executor.
+        :param executor: Executor running the calls.
+        """
+        self.executor = executor
+        self.submitted = []
+
+
+    def submit(self, function, *args):
+        self.submitted.append(args)
+        return self.executor.submit(function, *args)
@@ -0,0 +1,39 @@
+import argparse
+import timeit
+
+from bsread.data import json_backend
+
+
+main_header = {"htype": "bsr_m-1.1",
+               "hash": "0123456789abcdef0123456789abcdef",
+               "pulse_id": 12345678901,
+               "global_timestamp": {"sec": 1700000000, "ns": 123456789}}
+
+
+def run_tests(n_messages):
+    print(f"Test parameters: n_messages: {n_messages};")
+
+    for name in json_backend.available_backends:
+        json_backend.set_backend(name)
+        encoded = json_backend.dumps(main_header)
+
+        dumps_time = timeit.timeit(lambda: json_backend.dumps(main_header), number=n_messages) / n_messages
+        loads_time = timeit.timeit(lambda: json_backend.loads(encoded), number=n_messages) / n_messages
+
+        print(f"Backend {name}: dumps {dumps_time * 1e6:.2f} us/message, loads {loads_time * 1e6:.2f} us/message")
+        for rate in (100, 1000):
+            print(f"    {rate} Hz: {(dumps_time + loads_time) * rate * 1e3:.3f} ms CPU per second")
+
+    json_backend.set_backend(json_backend.default_backend)
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the JSON backends used for the bsread headers.")
+
+    parser.add_argument("n_messages", type=int, nargs="?", default=100000, help="Number of headers to encode/decode.")
+    inputs = parser.parse_args()
+
+    run_tests(inputs.n_messages)
@@ -0,0 +1,56 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bsread import PUB, Sender
+
+
+def measure_send(n_messages, data, compression_executor=None):
+    # PUB socket without subscribers - zmq drops the messages, only the sender is measured.
+    with Sender(port=9998, mode=PUB, data_compression="bitshuffle_lz4",
+                compression_executor=compression_executor) as stream:
+        stream.send(data=data)
+
+        start_time = time.perf_counter()
+        for _ in range(n_messages):
+            stream.send(data=data)
+        end_time = time.perf_counter()
+
+    return (end_time - start_time) / n_messages
+
+
+def run_tests(n_messages, n_channels, n_threads, image_size):
+    # Noisy images - realistic compression ratio.
+    data = {f"CAMERA-{index}": np.random.poisson(100, size=(image_size, image_size)).astype(np.uint16)
+            for index in range(n_channels)}
+    message_size = sum(image.nbytes for image in data.values())
+
+    print(f"Test parameters: n_messages: {n_messages}; n_channels: {n_channels}; n_threads: {n_threads}; "
+          f"image_size: {image_size}x{image_size} ({message_size / 1e6:.1f} MB/message);")
+
+    serial_time = measure_send(n_messages, data)
+    print(f"serial: {serial_time * 1e3:.2f} ms/message - {1 / serial_time:.1f} Hz, "
+          f"{message_size / serial_time / 1e6:.0f} MB/s")
+
+    with ThreadPoolExecutor(n_threads) as executor:
+        parallel_time = measure_send(n_messages, data, compression_executor=executor)
+    print(f"parallel: {parallel_time * 1e3:.2f} ms/message - {1 / parallel_time:.1f} Hz, "
+          f"{message_size / parallel_time / 1e6:.0f} MB/s ({serial_time / parallel_time:.1f}x)")
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the sustained send rate of bitshuffle_lz4 compressed "
+                                                 "images with serial and parallel compression.")
+
+    parser.add_argument("n_messages", type=int, nargs="?", default=100, help="Number of messages to send.")
+    parser.add_argument("n_channels", type=int, nargs="?", default=4, help="Number of image channels per message.")
+    parser.add_argument("--n_threads", type=int, default=4, help="Number of compression threads.")
+    parser.add_argument("--image_size", type=int, default=2048, help="Size of the (square) uint16 images.")
+    inputs = parser.parse_args()
+
+    run_tests(inputs.n_messages, inputs.n_channels, inputs.n_threads, inputs.image_size)
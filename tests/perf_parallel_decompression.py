@@ -0,0 +1,77 @@
+import argparse
+import hashlib
+import json
+import struct
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bsread.data.helpers import get_value_bytes
+from bsread.handlers.compact import Handler
+
+
+class FramesReceiver:
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.index = 0
+
+
+    def next(self, as_json=False):
+        frame = self.frames[self.index]
+        self.index += 1
+        return frame
+
+
+    def has_more(self):
+        return self.index < len(self.frames)
+
+
+
+def get_message_frames(n_channels, image_shape):
+    channels = []
+    frames = []
+
+    for index in range(n_channels):
+        image = np.random.randint(0, 256, size=image_shape, dtype=np.uint16)
+        channels.append({"name": f"camera_{index}", "type": "uint16", "shape": list(image_shape[::-1]),
+                         "compression": "bitshuffle_lz4"})
+        frames += [get_value_bytes(image, "bitshuffle_lz4"), struct.pack("<qq", 1, 2)]
+
+    data_header = json.dumps({"htype": "bsr_d-1.1", "channels": channels}).encode()
+    main_header = json.dumps({"htype": "bsr_m-1.1", "hash": hashlib.md5(data_header).hexdigest(), "pulse_id": 1,
+                              "global_timestamp": {"sec": 1, "ns": 2}}).encode()
+
+    return [main_header, data_header] + frames
+
+
+def run_tests(n_messages, n_channels, n_threads, image_size):
+    print(f"Test parameters: n_messages: {n_messages}; n_channels: {n_channels}; n_threads: {n_threads}; "
+          f"image_size: {image_size}x{image_size};")
+
+    frames = get_message_frames(n_channels, (image_size, image_size))
+
+    serial_handler = Handler()
+    serial_time = timeit.timeit(lambda: serial_handler.receive(FramesReceiver(frames)), number=n_messages)
+    print(f"serial: {serial_time / n_messages * 1e3:.3f} ms/message")
+
+    with ThreadPoolExecutor(n_threads) as executor:
+        parallel_handler = Handler(executor=executor)
+        parallel_time = timeit.timeit(lambda: parallel_handler.receive(FramesReceiver(frames)), number=n_messages)
+    print(f"parallel: {parallel_time / n_messages * 1e3:.3f} ms/message ({serial_time / parallel_time:.1f}x)")
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare serial and parallel decompression of compressed channels.")
+
+    parser.add_argument("n_messages", type=int, nargs="?", default=100, help="Number of messages to decode.")
+    parser.add_argument("n_channels", type=int, nargs="?", default=4, help="Number of compressed channels.")
+    parser.add_argument("--n_threads", type=int, default=4, help="Number of decompression threads.")
+    parser.add_argument("--image_size", type=int, default=1024, help="Size of the (square) uint16 images.")
+    inputs = parser.parse_args()
+
+    run_tests(inputs.n_messages, inputs.n_channels, inputs.n_threads, inputs.image_size)
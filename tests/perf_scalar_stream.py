@@ -0,0 +1,55 @@
+import argparse
+import time
+
+from bsread import PUB, Sender, Source
+
+
+def measure_send(n_messages, data):
+    # PUB socket without subscribers - zmq drops the messages, only the sender is measured.
+    with Sender(port=9998, mode=PUB) as stream:
+        stream.send(data=data)
+
+        start_time = time.perf_counter()
+        for _ in range(n_messages):
+            stream.send(data=data)
+        end_time = time.perf_counter()
+
+    return (end_time - start_time) / n_messages
+
+
+def measure_receive(n_messages, data, **source_kwargs):
+    # Unlimited queues - all messages are queued on the receiving side before the measurement starts.
+    with Source(host="localhost", port=9997, queue_size=0, **source_kwargs) as in_stream:
+        with Sender(port=9997, queue_size=0) as stream:
+            for _ in range(n_messages + 1):
+                stream.send(data=data)
+
+            in_stream.receive()
+
+            start_time = time.perf_counter()
+            for _ in range(n_messages):
+                in_stream.receive()
+            end_time = time.perf_counter()
+
+    return (end_time - start_time) / n_messages
+
+
+def run_tests(n_messages, n_channels):
+    data = {f"CHANNEL-{index}": float(index) for index in range(n_channels)}
+
+    print(f"Test parameters: n_messages: {n_messages}; n_channels: {n_channels};")
+    print(f"Send: {measure_send(n_messages, data) * 1e6:.1f} us/message")
+    print(f"Receive: {measure_receive(n_messages, data) * 1e6:.1f} us/message")
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure send and receive time of scalar streams.")
+
+    parser.add_argument("n_messages", type=int, nargs="?", default=1000, help="Number of messages to send/receive.")
+    parser.add_argument("n_channels", type=int, nargs="?", default=500, help="Number of scalar channels per message.")
+    inputs = parser.parse_args()
+
+    run_tests(inputs.n_messages, inputs.n_channels)
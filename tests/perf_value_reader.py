@@ -0,0 +1,36 @@
+import argparse
+import timeit
+
+import numpy as np
+
+from bsread.data.helpers import get_value_reader
+
+
+def run_tests(n_values):
+    print(f"Test parameters: n_values: {n_values};")
+
+    for channel_type, dtype in [("float64", "f8"), ("float32", "f4"), ("int32", "i4"), ("uint16", "u2")]:
+        for endianness in ("<", ">"):
+            raw_data = np.ones(1, dtype=endianness + dtype).tobytes()
+
+            # The generic reader is selected for 1 element arrays, the scalar reader for scalars.
+            generic_reader = get_value_reader(channel_type, None, shape=[1, 1], endianness=endianness)
+            scalar_reader = get_value_reader(channel_type, None, shape=[1], endianness=endianness)
+
+            generic_time = timeit.timeit(lambda: generic_reader(raw_data), number=n_values) / n_values
+            scalar_time = timeit.timeit(lambda: scalar_reader(raw_data), number=n_values) / n_values
+
+            print(f"{endianness}{channel_type}: generic {generic_time * 1e6:.3f} us/value, "
+                  f"scalar {scalar_time * 1e6:.3f} us/value ({generic_time / scalar_time:.1f}x)")
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the generic and the scalar value reader.")
+
+    parser.add_argument("n_values", type=int, nargs="?", default=100000, help="Number of values to decode.")
+    inputs = parser.parse_args()
+
+    run_tests(inputs.n_values)
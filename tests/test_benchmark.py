@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+import unittest
+
+import numpy as np
+
+from bsread.cli import benchmark
+from bsread.data.serialization import compression_provider_mapping
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_synthetic_arrays(self):
+        arrays = benchmark.get_synthetic_arrays(["uint16", "int64", "float32"], ["64", "16x32"])
+        self.assertEqual(len(arrays), 3 * 2 * len(benchmark.profiles))
+
+        for dtype, shape, profile, array in arrays:
+            self.assertEqual(array.dtype, np.dtype(dtype))
+            self.assertEqual(array.shape, shape)
+
+        # The profiles differ in entropy - random data does not compress.
+        ratios = {profile: array.nbytes / len(compression_provider_mapping["bitshuffle_lz4"].pack_data(array, "u2"))
+                  for _, _, profile, array in benchmark.get_synthetic_arrays(["uint16"], ["256x256"])}
+        self.assertGreater(ratios["zeros"], ratios["sparse"])
+        self.assertGreater(ratios["noise"], ratios["random"])
+        self.assertLess(ratios["random"], 1.1)
+
+        self.assertRaises(ValueError, benchmark.get_synthetic_array, "uint16", (10,), "unknown")
+
+
+    def test_run_benchmarks(self):
+        arrays = benchmark.get_synthetic_arrays(["uint16"], ["32x32"], ["noise", "zeros"])
+        results = benchmark.run_benchmarks(arrays, min_time=0.001, repeat=1)
+
+        compressions = [compression for compression in compression_provider_mapping if compression is not None]
+        self.assertEqual(len(results), 2 * len(compressions))
+
+        for result in results:
+            self.assertListEqual(list(result.keys()), benchmark.result_fields)
+            self.assertEqual(result["shape"], "32x32")
+            self.assertEqual(result["n_bytes"], 32 * 32 * 2)
+            self.assertGreater(result["compress_mb_s"], 0)
+            self.assertGreater(result["decompress_mb_s"], 0)
+
+        # Machine readable output.
+        for output_format in ("json", "csv", "table"):
+            stream = io.StringIO()
+            benchmark.write_results(results, output_format, stream)
+            stream.seek(0)
+
+            if output_format == "json":
+                self.assertListEqual(json.load(stream), results)
+            elif output_format == "csv":
+                rows = list(csv.DictReader(stream))
+                self.assertListEqual([row["compression"] for row in rows],
+                                     [result["compression"] for result in results])
+
+        self.assertRaises(ValueError, benchmark.run_benchmarks, arrays, ["unknown"])
+
+
+if __name__ == "__main__":
+    unittest.main()
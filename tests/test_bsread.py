@@ -1,7 +1,12 @@
+import gc
 import logging
 import unittest
+import weakref
+
+import numpy as np
 
 from bsread.data.helpers import get_value_reader
+from bsread.handlers.plans import DecoderPlanCache
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -68,6 +73,51 @@ class TestGenerator(unittest.TestCase):
                 # message = in_stream.receive(filter=filter_method)
 
 
+    def test_receive_header_filter(self):
+        from bsread import Sender, Source
+
+        with Source(host="localhost", port=9999) as in_stream:
+
+            with Sender(queue_size=20) as stream:
+                for i in range(12):
+                    stream.send(one=i)
+
+                message = in_stream.receive(header_filter=lambda m: m.pulse_id % 5 == 0)
+                self.assertEqual(message.data.pulse_id, 0)
+                self.assertEqual(message.data.data["one"].value, 0)
+
+                # Header filter and filter can be combined.
+                message = in_stream.receive(header_filter=lambda m: m.pulse_id % 5 == 0,
+                                            filter=lambda m: m.data.data["one"].value > 5)
+                self.assertEqual(message.data.pulse_id, 10)
+                self.assertEqual(message.data.data["one"].value, 10)
+
+
+    def test_scalar_value_reader(self):
+        from bsread.data.serialization import channel_type_deserializer_mapping
+
+        for channel_type, (dtype, _) in channel_type_deserializer_mapping.items():
+            if channel_type in (None, "string"):
+                continue
+
+            for endianness in ("<", ">"):
+                value = np.ones(1, dtype=endianness + dtype)
+
+                for shape in (None, [1]):
+                    value_reader = get_value_reader(channel_type, None, shape=shape, endianness=endianness)
+                    result = value_reader(value.tobytes())
+
+                    # Same result as the generic (numpy) reader - a numpy scalar of the channel type.
+                    self.assertEqual(result, value[0])
+                    self.assertEqual(result.dtype, np.dtype(dtype))
+
+                # Raw data with more than one value is returned as array.
+                result = value_reader(np.ones(3, dtype=endianness + dtype).tobytes())
+                self.assertEqual(len(result), 3)
+
+                self.assertIsNone(value_reader(b""))
+
+
     def test_failed_conversion(self):
         channel_type = "int32"
         compression = None
@@ -83,6 +133,175 @@ class TestGenerator(unittest.TestCase):
         self.assertEqual(None, result)
 
 
+    def test_unpack_data_out(self):
+        from bsread.data import compression
+        from bsread.data.compression import BitshuffleLZ4, BitshuffleZstd, Blosc2, LZ4, NoCompression
+
+        value = np.arange(64 * 32, dtype=">u2").reshape(32, 64)
+        shape = [64, 32]
+
+        native_functions = (compression._bshuf_decompress_lz4, compression._bshuf_decompress_zstd,
+                            compression._lz4_decompress_safe)
+        providers = [provider for provider in (NoCompression, LZ4, BitshuffleLZ4, BitshuffleZstd, Blosc2)
+                     if getattr(provider, "available", True)]
+
+        try:
+            # With the native (ctypes) decompression and with the Python API fallback.
+            for native in (True, False):
+                if not native:
+                    compression._bshuf_decompress_lz4 = None
+                    compression._bshuf_decompress_zstd = None
+                    compression._lz4_decompress_safe = None
+
+                for provider in providers:
+                    raw_bytes = provider.pack_data(value, ">u2")
+
+                    self.assertEqual(provider.get_unpacked_shape(raw_bytes, ">u2", shape), (32, 64))
+                    np.testing.assert_array_equal(provider.unpack_data(raw_bytes, ">u2", shape), value)
+
+                    # The data is unpacked into the provided array.
+                    out = np.zeros((32, 64), dtype=">u2")
+                    self.assertIs(provider.unpack_data(raw_bytes, ">u2", shape, out=out), out)
+                    np.testing.assert_array_equal(out, value)
+
+                    # Arrays that do not fit are rejected.
+                    self.assertRaises(ValueError, provider.unpack_data, raw_bytes, ">u2", shape,
+                                      out=np.zeros((32, 64), dtype="<u2"))
+                    self.assertRaises(ValueError, provider.unpack_data, raw_bytes, ">u2", shape,
+                                      out=np.zeros((64, 32), dtype=">u2"))
+
+                    # Without shape the data is returned flat.
+                    np.testing.assert_array_equal(provider.unpack_data(raw_bytes, ">u2"), value.reshape(-1))
+
+                    # Empty data.
+                    empty_bytes = provider.pack_data(np.array([], dtype=">u2"), ">u2")
+                    self.assertIsNone(provider.get_unpacked_shape(empty_bytes, ">u2"))
+                    self.assertIsNone(provider.unpack_data(empty_bytes, ">u2"))
+        finally:
+            (compression._bshuf_decompress_lz4, compression._bshuf_decompress_zstd,
+             compression._lz4_decompress_safe) = native_functions
+
+
+    def test_unpack_data_invalid(self):
+        from bsread.data.compression import BitshuffleLZ4, BitshuffleZstd, LZ4
+
+        value = np.random.default_rng(0).normal(1000, 4, 4097).astype("<u2")
+
+        # Truncated payloads are rejected before decompressing.
+        for provider in [provider for provider in (BitshuffleLZ4, BitshuffleZstd)
+                         if getattr(provider, "available", True)]:
+            raw_bytes = provider.pack_data(value, "<u2")
+            np.testing.assert_array_equal(provider.unpack_data(raw_bytes, "<u2", [4097]), value)
+
+            for n_missing_bytes in (1, 4, 100, len(raw_bytes) - 11):
+                self.assertRaises(ValueError, provider.unpack_data, raw_bytes[:-n_missing_bytes], "<u2", [4097])
+
+        # The LZ4 size header is little endian for all arrays - an invalid (e.g. byte swapped) size is rejected.
+        value = np.arange(100, dtype=">f8")
+        raw_bytes = LZ4.pack_data(value)
+        np.testing.assert_array_equal(LZ4.unpack_data(raw_bytes, ">f8"), value)
+        self.assertRaises(ValueError, LZ4.unpack_data, raw_bytes[3::-1] + raw_bytes[4:], ">f8")
+
+
+    def test_value_reader_allocator(self):
+        from bsread.data.helpers import get_value_bytes
+
+        allocations = []
+
+        def allocator(dtype, shape):
+            allocations.append((dtype, shape))
+            return np.empty(shape, dtype=dtype)
+
+        value = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+        for compression in ("bitshuffle_lz4", "lz4", None):
+            value_reader = get_value_reader("float32", compression, shape=[4, 3], endianness="<",
+                                            allocator=allocator)
+            np.testing.assert_array_equal(value_reader(get_value_bytes(value, compression)), value)
+
+        # Uncompressed values are views of the frame and need no array.
+        self.assertListEqual(allocations, [(np.dtype("<f4"), (3, 4))] * 2)
+
+
+    def test_decoder_plan_cache(self):
+        from bsread import Sender, Source
+        from bsread.handlers.compact import Handler
+
+        plan_cache = DecoderPlanCache(max_size=2)
+
+        with Source(host="localhost", port=9999) as in_stream:
+            handler = Handler(plan_cache=plan_cache)
+
+            with Sender(queue_size=10) as stream:
+                # Alternate between two data headers.
+                for i in range(6):
+                    if i % 2:
+                        stream.send(one=i, two=2.0)
+                    else:
+                        stream.send(one=i)
+
+                for i in range(6):
+                    message = in_stream.receive(handler=handler.receive)
+                    self.assertEqual(message.data.data["one"].value, i)
+                    self.assertEqual("two" in message.data.data, bool(i % 2))
+                    self.assertTrue(message.data.format_changed)
+
+        # Only the first occurrence of each data header was parsed.
+        self.assertEqual(plan_cache.misses, 2)
+        self.assertEqual(plan_cache.hits, 4)
+        self.assertEqual(len(plan_cache), 2)
+
+        # Least recently used plans are evicted.
+        plan_cache.get("third", b'{"htype": "bsr_d-1.1", "channels": []}')
+        self.assertEqual(len(plan_cache), 2)
+        self.assertEqual(plan_cache.misses, 3)
+
+
+    def test_buffer_pool_released(self):
+        from bsread import Sender, Source
+        from bsread.data.buffer_pool import BufferPool
+
+        buffer_pool = BufferPool()
+        buffer_pool_reference = weakref.ref(buffer_pool)
+
+        with Source(host="localhost", port=9999, buffer_pool=buffer_pool) as in_stream:
+            with Sender(queue_size=10, data_compression="bitshuffle_lz4") as stream:
+                stream.send(image=np.arange(1024, dtype=np.uint16))
+
+                message = in_stream.receive()
+                self.assertEqual(message.data.data["image"].value.size, 1024)
+                message.data.release()
+
+        # The plans of a source with buffer pool are not cached in the shared cache - the pool (and its arrays) is
+        # garbage collected with the closed source.
+        del buffer_pool, in_stream, message
+        gc.collect()
+        self.assertIsNone(buffer_pool_reference())
+
+
+    def test_extended_allocator_released(self):
+        from bsread import Sender, Source
+        from bsread.data.buffer_pool import BufferPool
+        from bsread.handlers import extended
+
+        buffer_pool = BufferPool()
+        buffer_pool_reference = weakref.ref(buffer_pool)
+
+        handler = extended.Handler(allocator=buffer_pool.allocate)
+
+        with Source(host="localhost", port=9999) as in_stream:
+            with Sender(queue_size=10, data_compression="bitshuffle_lz4") as stream:
+                stream.send(image=np.arange(1024, dtype=np.uint16))
+
+                message = in_stream.receive(handler=handler.receive)
+                self.assertEqual(message.data["data"][0].size, 1024)
+
+        # As with the compact handler, the plans of a handler with allocator are not cached in the shared cache.
+        del buffer_pool, handler, message
+        gc.collect()
+        self.assertIsNone(buffer_pool_reference())
+
+
 
 
 
@@ -0,0 +1,31 @@
+import unittest
+
+from bsread.data import json_backend
+
+
+class TestJsonBackend(unittest.TestCase):
+
+    def tearDown(self):
+        json_backend.set_backend(json_backend.default_backend)
+
+
+    def test_backends(self):
+        main_header = {"htype": "bsr_m-1.1", "hash": "0123456789abcdef0123456789abcdef",
+                       "pulse_id": 12345678901, "global_timestamp": {"sec": 1700000000, "ns": 123456789}}
+
+        for name in json_backend.available_backends:
+            json_backend.set_backend(name)
+            self.assertEqual(json_backend.backend, name)
+
+            encoded = json_backend.dumps(main_header)
+            self.assertIsInstance(encoded, bytes)
+
+            # All backends decode str, bytes and memoryviews (zero-copy frames).
+            self.assertEqual(json_backend.loads(encoded), main_header)
+            self.assertEqual(json_backend.loads(encoded.decode()), main_header)
+            self.assertEqual(json_backend.loads(memoryview(encoded)), main_header)
+
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            json_backend.set_backend("does_not_exist")
@@ -1,11 +1,28 @@
+import json
 import logging
+import os
+import struct
+import tempfile
+import time
 import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Barrier, Event, Thread
 
 import numpy as np
 
 import bsread.data.helpers
-from bsread import Sender, Source
-from bsread.data.helpers import get_channel_specs, get_serialization_type
+from bsread import DROP_NEWEST, DROP_OLDEST, PUB, SKIP, Sender, Source
+from bsread.calibration import BlockSizeCalibration, CalibratingEncoder
+from bsread.data import json_backend
+from bsread.data.buffer_pool import BufferPool
+from bsread.handlers.compact import Message, MessageBatch
+from bsread.data.helpers import (get_channel_encoding, get_channel_specs, get_serialization_type, get_value_bytes,
+                                 get_value_encoder)
+from bsread.data.serialization import compression_provider_mapping
+from bsread.pacing import Pacer, PacingStatistics
+from bsread.pipeline import SendPipeline
+from bsread.sender import _get_main_header_template
+from executors import CountingExecutor
 
 
 logging.basicConfig(level=logging.DEBUG)  # Changeing of debug level needs to be done before the import for unit testing
@@ -21,6 +38,31 @@ class TestGenerator(unittest.TestCase):
         print(new_value)
 
 
+    def test_value_encoder(self):
+        values = [1, 1.5, True, -3, np.float32(2.5), np.int16(-7), np.uint64(2 ** 63), np.bool_(True),
+                  np.arange(6, dtype=">i4").reshape(2, 3), np.arange(4.0)[::2], np.array([], dtype=np.float32),
+                  [1, 2, 3], "test",
+                  # Out of the range of some channel types.
+                  1e40, 2.0 ** 200, -1e300, 2 ** 40, -2 ** 63 - 1, 2 ** 64, 256, -1]
+
+        for channel_type in ["float64", "float32", "int32", "int64", "uint8", "bool", "string", None]:
+            for compression in [None, "bitshuffle_lz4", "lz4"]:
+                for copy_arrays in [True, False]:
+                    encoder = get_value_encoder(channel_type, compression, copy_arrays=copy_arrays)
+
+                    for value in values:
+                        try:
+                            expected = get_value_bytes(value, compression, channel_type=channel_type)
+                        except Exception as error:
+                            # The same error as the generic path.
+                            self.assertRaises(type(error), encoder, value)
+                            continue
+
+                        # Encoders may return buffers instead of bytes.
+                        self.assertEqual(bytes(memoryview(encoder(value))), expected,
+                                         f"{value!r} as {channel_type} with compression {compression}")
+
+
     def test__get_type(self):
         # Integers are 64bit.
         value = 1
@@ -204,6 +246,48 @@ class TestGenerator(unittest.TestCase):
                         self.assertEqual(compressed_received_value, value, "Compressed channel values not as expected")
 
 
+    def test_compression_providers(self):
+        # All available compressions - the optional ones only if their libraries are installed.
+        compressions = [compression for compression in compression_provider_mapping
+                        if compression not in (None, "none")]
+
+        values = {
+            "array": [1, 2, 3, 4, 5],
+            "int": -12,
+            "float": 99.0,
+            "string": "testing string",
+            "test_none": None,
+            "numpy_array": np.array([1., 2., 3., 4, 5., 6], dtype=np.float32).reshape(2, 3),
+            "big_endian_array": np.arange(1000, dtype=">i4"),
+            "empty_numpy_array": np.array([], dtype=np.float32),
+        }
+
+        for compression in compressions:
+            with self.subTest(compression=compression):
+                with Source(host="localhost") as receive_stream:
+                    with Sender() as send_stream:
+                        for name, value in values.items():
+                            channel_type, data_shape = get_channel_specs(value)
+                            send_stream.add_channel(name, lambda pulse_id, value=value: value,
+                                                    {"type": channel_type, "shape": data_shape,
+                                                     "encoding": get_channel_encoding(value),
+                                                     "compression": compression})
+
+                        send_stream.send()
+                        response = receive_stream.receive()
+
+                for name, value in values.items():
+                    received_value = response.data.data[name].value
+
+                    # Empty arrays are transferred as None.
+                    if isinstance(value, np.ndarray) and not value.size:
+                        self.assertIsNone(received_value)
+                    elif isinstance(value, (list, np.ndarray)):
+                        np.testing.assert_array_equal(received_value, value)
+                    else:
+                        self.assertEqual(received_value, value)
+
+
     def test_non_native_types(self):
         with Source(host="localhost") as receive_stream:
             with Sender() as send_stream:
@@ -262,6 +346,36 @@ class TestGenerator(unittest.TestCase):
                                  "Global and channel timestamps offset have to be the same.")
 
 
+    def test_channel_timestamps(self):
+        send_data = {"little": np.ones(4, dtype="<i4"), "big": np.ones(4, dtype=">i4"), "none": None, "scalar": 1}
+
+        with Source(host="localhost") as receive_stream:
+            with Sender() as send_stream:
+                send_stream.send(data=send_data, timestamp=(123, 456),
+                                 channel_timestamps=[[1, 10], [2, 20], [3, 30], [4, 40]])
+                send_stream.send(data=send_data, channel_timestamps=np.array([1.5, 2.25, 3.0, 4.75]))
+
+                # One timestamp per channel is required.
+                self.assertRaises(ValueError, send_stream.send, data=send_data, channel_timestamps=[1.0, 2.0])
+
+                message_1 = receive_stream.receive().data
+                message_2 = receive_stream.receive().data
+
+        self.assertEqual(message_1.global_timestamp, 123)
+        self.assertEqual(message_1.global_timestamp_offset, 456)
+
+        for name, timestamp, timestamp_offset in [("little", 1, 10), ("big", 2, 20), ("scalar", 4, 40)]:
+            self.assertEqual(message_1.data[name].timestamp, timestamp)
+            self.assertEqual(message_1.data[name].timestamp_offset, timestamp_offset)
+
+        for name, timestamp, timestamp_offset in [("little", 1, 5e8), ("big", 2, 2.5e8), ("scalar", 4, 7.5e8)]:
+            self.assertEqual(message_2.data[name].timestamp, timestamp)
+            self.assertEqual(message_2.data[name].timestamp_offset, timestamp_offset)
+
+        # None values are sent without timestamp.
+        self.assertIsNone(message_1.data["none"].timestamp)
+
+
     def test_byteorder(self):
         send_data = {"test_1": np.ones(shape=1024, dtype=">i2"),
                      "test_2": np.ones(shape=1024, dtype=">i4"),
@@ -342,6 +456,762 @@ class TestGenerator(unittest.TestCase):
             np.testing.assert_array_equal(send_data[name], received_message.data.data[name].value)
 
 
+    def test_zero_copy_receive(self):
+        image = np.arange(256 * 128, dtype=np.uint16).reshape(128, 256)
+
+        with Source(host="localhost", copy=False) as receive_stream:
+            with Sender() as send_stream:
+                send_stream.send(data={"image": image, "scalar": 1, "string": "test"})
+                message = receive_stream.receive()
+
+                send_stream.send(data={"image": image + 1, "scalar": 2, "string": "test"})
+                receive_stream.receive()
+
+        received_image = message.data.data["image"].value
+
+        # The array references the received frame and was not copied.
+        base = received_image
+        while isinstance(base, np.ndarray):
+            base = base.base
+        self.assertIsInstance(base, memoryview)
+
+        # The frame is still valid after receiving further messages.
+        np.testing.assert_array_equal(received_image, image)
+        self.assertEqual(message.data.data["scalar"].value, 1)
+        self.assertEqual(message.data.data["string"].value, "test")
+
+
+    def test_receive_batch(self):
+        with Source(host="localhost") as receive_stream:
+            with Sender() as send_stream:
+                for pulse_id in range(5):
+                    waveform = np.full(4, pulse_id, dtype=np.float32)
+                    send_stream.send(data={"scalar": pulse_id, "waveform": waveform,
+                                           "sparse": 1.0 if pulse_id % 2 else None},
+                                     timestamp=(100 + pulse_id, 200))
+
+                batch = receive_stream.receive_batch(10, timeout=500)
+
+        self.assertEqual(len(batch), 5)
+        np.testing.assert_array_equal(batch.pulse_id, np.arange(5))
+        np.testing.assert_array_equal(batch.global_timestamp, np.arange(5) + 100)
+        np.testing.assert_array_equal(batch.global_timestamp_offset, np.full(5, 200))
+
+        np.testing.assert_array_equal(batch.data["scalar"], np.arange(5))
+        self.assertTrue(batch.valid["scalar"].all())
+
+        self.assertEqual(batch.data["waveform"].shape, (5, 4))
+        self.assertEqual(batch.data["waveform"].dtype, np.float32)
+        np.testing.assert_array_equal(batch.data["waveform"][:, 0], np.arange(5))
+
+        np.testing.assert_array_equal(batch.valid["sparse"], [False, True, False, True, False])
+        self.assertTrue(batch.global_timestamp_valid.all())
+
+        # Messages that cannot be decoded are skipped - without timeout the batch is still filled.
+        with Source(host="localhost", receive_timeout=1000) as receive_stream:
+            receive = receive_stream.stream.receive
+
+            def receive_undecodable(*args, **kwargs):
+                message = receive(*args, **kwargs)
+                return None if message.data.pulse_id == 1 else message
+
+            receive_stream.stream.receive = receive_undecodable
+
+            with Sender() as send_stream:
+                for pulse_id in range(5):
+                    send_stream.send(data={"scalar": pulse_id})
+
+                batch = receive_stream.receive_batch(4)
+
+        np.testing.assert_array_equal(batch.pulse_id, [0, 2, 3, 4])
+
+        # Messages without global timestamp.
+        batch = MessageBatch(2)
+        batch.add(Message(pulse_id=1, global_timestamp=None, global_timestamp_offset=None, data={}))
+        batch.truncate()
+        np.testing.assert_array_equal(batch.global_timestamp_valid, [False])
+
+
+    def test_lazy_receive(self):
+        image = np.arange(64 * 32, dtype=np.float32).reshape(32, 64)
+
+        with Source(host="localhost", lazy=True) as receive_stream:
+            with Sender(data_compression="bitshuffle_lz4") as send_stream:
+                send_stream.send(data={"image": image, "scalar": 1}, timestamp=(123, 456))
+                message = receive_stream.receive()
+
+        received_image = message.data.data["image"]
+        received_scalar = message.data.data["scalar"]
+
+        # Nothing is decoded before the values are accessed - timestamps are available anyway.
+        self.assertFalse(received_image.is_decoded)
+        self.assertFalse(received_scalar.is_decoded)
+        self.assertEqual(received_image.timestamp, 123)
+        self.assertEqual(received_image.timestamp_offset, 456)
+
+        np.testing.assert_array_equal(received_image.value, image)
+        self.assertTrue(received_image.is_decoded)
+        self.assertFalse(received_scalar.is_decoded)
+
+        # The decoded value is cached.
+        self.assertIs(received_image.value, received_image.value)
+        self.assertEqual(received_scalar.value, 1)
+
+
+    def test_projection(self):
+        with Source(host="localhost", projection=["two", "four"]) as receive_stream:
+            with Sender() as send_stream:
+                send_stream.send(one=1, two=2, three=np.ones(10), four="four", timestamp=(123, 456))
+                message = receive_stream.receive()
+
+        self.assertListEqual(list(message.data.data.keys()), ["two", "four"])
+        self.assertEqual(message.data.data["two"].value, 2)
+        self.assertEqual(message.data.data["two"].timestamp, 123)
+        self.assertEqual(message.data.data["four"].value, "four")
+        self.assertEqual(message.data.data["four"].timestamp_offset, 456)
+
+
+    def test_parallel_decompression(self):
+        images = {f"image_{index}": np.random.randint(0, 1000, size=(64, 128), dtype=np.uint16)
+                  for index in range(4)}
+        send_data = dict(images, small=np.arange(16, dtype=np.float32), scalar=1.5)
+
+        with ThreadPoolExecutor(2) as executor:
+            counting_executor = CountingExecutor(executor)
+
+            with Source(host="localhost", decompression_executor=counting_executor) as receive_stream:
+                receive_stream.handler.parallel_threshold = 1024
+
+                with Sender(data_compression="bitshuffle_lz4") as send_stream:
+                    send_stream.send(data=send_data, timestamp=(123, 456))
+                    message = receive_stream.receive()
+
+        # Only the large compressed channels are decompressed by the executor.
+        self.assertEqual(len(counting_executor.submitted), len(images))
+
+        for name, value in send_data.items():
+            np.testing.assert_array_equal(message.data.data[name].value, value)
+            self.assertEqual(message.data.data[name].timestamp, 123)
+
+
+    def test_parallel_compression(self):
+        images = {f"image_{index}": np.random.randint(0, 1000, size=(64, 128), dtype=np.uint16)
+                  for index in range(4)}
+        send_data = dict(images, small=np.arange(16, dtype=np.float32), scalar=1.5, none=None)
+
+        with ThreadPoolExecutor(2) as executor:
+            counting_executor = CountingExecutor(executor)
+
+            with Source(host="localhost") as receive_stream:
+                with Sender(data_compression="bitshuffle_lz4", compression_executor=counting_executor,
+                            parallel_threshold=1024) as send_stream:
+                    send_stream.send(data=send_data, timestamp=(123, 456))
+                    message = receive_stream.receive()
+
+        # Only the large arrays are compressed by the executor, the frame order is kept.
+        self.assertEqual(len(counting_executor.submitted), len(images))
+        self.assertListEqual(list(message.data.data.keys()), list(send_data.keys()))
+
+        for name, value in send_data.items():
+            if value is None:
+                self.assertIsNone(message.data.data[name].value)
+            else:
+                np.testing.assert_array_equal(message.data.data[name].value, value)
+                self.assertEqual(message.data.data[name].timestamp, 123)
+
+
+    def test_buffer_pool(self):
+        buffer_pool = BufferPool(max_free_buffers=2)
+        images = [np.random.randint(0, 1000, size=(64, 128), dtype=np.uint16) for _ in range(5)]
+
+        with Source(host="localhost", buffer_pool=buffer_pool) as receive_stream:
+            with Sender(data_compression="bitshuffle_lz4") as send_stream:
+                for image in images:
+                    send_stream.send(image=image, scalar=1.5)
+
+                for image in images:
+                    with receive_stream.receive().data as message:
+                        np.testing.assert_array_equal(message.data["image"].value, image)
+                        self.assertEqual(message.data["scalar"].value, 1.5)
+
+                    # Released values are cleared - uncompressed values are not pooled.
+                    self.assertIsNone(message.data["image"].value)
+                    self.assertEqual(message.data["scalar"].value, 1.5)
+
+                # Messages kept are not recycled.
+                send_stream.send(image=images[0], scalar=1.5)
+                send_stream.send(image=images[1], scalar=1.5)
+                kept = receive_stream.receive().data
+                released = receive_stream.receive().data
+                released.release()
+
+        # The array of the first message is reused by all following messages.
+        statistics = buffer_pool.statistics
+        self.assertEqual(statistics["allocated"], 2)
+        self.assertEqual(statistics["reused"], 5)
+        self.assertEqual(statistics["released"], 6)
+        self.assertEqual(statistics["in_use"], 1)
+        self.assertEqual(statistics["max_in_use"], 2)
+        self.assertEqual(statistics["max_in_use_bytes"], 2 * images[0].nbytes)
+        np.testing.assert_array_equal(kept.data["image"].value, images[0])
+
+        # Arrays not released are not in use anymore once collected - arrays of other pools are ignored.
+        del kept
+        self.assertEqual(buffer_pool.n_in_use, 0)
+        self.assertFalse(buffer_pool.release(np.zeros(10)))
+
+        buffer_pool.clear()
+        self.assertEqual(buffer_pool.statistics["free_bytes"], 0)
+
+
+    def test_block_size_calibration(self):
+        images = [np.random.randint(0, 1000, size=(64, 128), dtype=np.uint16) for _ in range(4)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "calibration.json")
+
+            calibration = BlockSizeCalibration(n_values=3, block_sizes=(1024, 4096, 16384), file_name=file_name)
+
+            with Source(host="localhost") as receive_stream:
+                with Sender(data_compression="bitshuffle_lz4", block_size_calibration=calibration) as send_stream:
+                    for image in images:
+                        send_stream.send(image=image, scalar=1.5)
+                        message = receive_stream.receive()
+                        np.testing.assert_array_equal(message.data.data["image"].value, image)
+
+                    encoder = send_stream.channels["image"].encoder
+
+            # The first 3 values are measured with all candidate block sizes, then the block size is pinned.
+            block_size = calibration.channels["image"]["block_size"]
+            self.assertIn(block_size, (1024, 4096, 16384))
+            self.assertNotIn("scalar", calibration.channels)
+            self.assertIsInstance(encoder, CalibratingEncoder)
+            self.assertTrue(encoder.calibrated)
+            self.assertEqual(len(calibration.measurements["image"]), 3)
+
+            # Block size in the header of the compressed bytes (in bytes).
+            self.assertEqual(struct.unpack(">i", encoder(images[0])[8:12])[0], block_size)
+
+            # The calibration is reused after a restart - only if the channel did not change.
+            calibration = BlockSizeCalibration(n_values=3, file_name=file_name)
+            metadata = {"name": "image", "type": "uint16", "shape": [128, 64], "compression": "bitshuffle_lz4"}
+            self.assertEqual(calibration.get_block_size(metadata), block_size)
+            self.assertIsNone(calibration.get_block_size(dict(metadata, shape=[64, 64])))
+
+            # Shapes given as tuples are reused after the roundtrip through the file as well.
+            metadata = dict(metadata, name="tuple_image", shape=(128, 64))
+            calibration.set_block_size(metadata, 4096)
+            calibration = BlockSizeCalibration(n_values=3, file_name=file_name)
+            self.assertEqual(calibration.get_block_size(metadata), 4096)
+
+            with Sender(mode=PUB, data_compression="bitshuffle_lz4",
+                        block_size_calibration=calibration) as send_stream:
+                send_stream.send(image=images[0])
+                self.assertNotIsInstance(send_stream.channels["image"].encoder, CalibratingEncoder)
+
+        self.assertEqual(calibration.select_block_size([{"block_size": 1, "ratio": 2.0, "mb_s": 100},
+                                                        {"block_size": 2, "ratio": 1.99, "mb_s": 200},
+                                                        {"block_size": 3, "ratio": 1.5, "mb_s": 300}]), 2)
+
+
+    def test_pipeline(self):
+        with Source(host="localhost") as receive_stream:
+            with Sender(pipeline_depth=4) as send_stream:
+                send_stream.add_channel("function", lambda pulse_id: pulse_id * 2.0)
+
+                for pulse_id in range(10):
+                    send_stream.send(pulse_id=pulse_id, timestamp=(123, pulse_id))
+
+                self.assertTrue(send_stream.pipeline.flush(timeout=5))
+                self.assertEqual(send_stream.pipeline.n_sent, 10)
+
+                # Data passed to send is encoded in the pipeline as well.
+                send_stream.send(data={"one": 1, "two": np.arange(4)})
+
+                messages = [receive_stream.receive() for _ in range(11)]
+
+        for pulse_id, message in enumerate(messages[:10]):
+            self.assertEqual(message.data.pulse_id, pulse_id)
+            self.assertEqual(message.data.global_timestamp_offset, pulse_id)
+            self.assertEqual(message.data.data["function"].value, pulse_id * 2)
+
+        self.assertEqual(messages[10].data.pulse_id, 10)
+        self.assertEqual(messages[10].data.data["one"].value, 1)
+        np.testing.assert_array_equal(messages[10].data.data["two"].value, np.arange(4))
+
+
+    def test_pipeline_pre_function(self):
+        for pipeline_depth in [None, 4]:
+            with Sender(mode=PUB, pipeline_depth=pipeline_depth) as send_stream:
+                send_stream.add_channel("function", lambda pulse_id: calls.append("function") or 1.0)
+
+                calls = []
+                send_stream.pre_function = lambda: calls.append(list(send_stream.channels))
+                send_stream.post_function = lambda: calls.append("post")
+
+                # The channel functions are called after the pre function and the pre function sees the channel
+                # metadata updated from the data - in both modes.
+                send_stream.send()
+                send_stream.send(data={"one": 1})
+
+            self.assertListEqual(calls, [["function"], "function", "post", ["one"], "post"])
+
+
+    def test_pipeline_stop_timeout(self):
+        release = Event()
+
+        def send_function(frames):
+            release.wait(5)
+
+        pipeline = SendPipeline(lambda message: message, send_function, depth=4)
+        pipeline.start()
+
+        for message in range(3):
+            pipeline.put(message)
+
+        # The blocked send does not block the stop - the messages not sent are dropped.
+        stopped = Event()
+        start_time = time.time()
+        self.assertFalse(pipeline.stop(timeout=0.1, on_stopped=stopped.set))
+        self.assertLess(time.time() - start_time, 2)
+        self.assertEqual(pipeline.n_dropped, 2)
+
+        # The I/O worker is still sending - it calls on_stopped once the send returned.
+        self.assertFalse(stopped.is_set())
+        release.set()
+        self.assertTrue(stopped.wait(5))
+        self.assertTrue(pipeline.flush(timeout=5))
+        self.assertEqual(pipeline.n_sent, 1)
+
+        # Without timeout, on_stopped is called before stop returns.
+        pipeline = SendPipeline(lambda message: message, lambda frames: None)
+        pipeline.start()
+        pipeline.put(0)
+
+        stopped = Event()
+        self.assertTrue(pipeline.stop(on_stopped=stopped.set))
+        self.assertTrue(stopped.is_set())
+
+
+    def test_pipeline_stop_blocked_put(self):
+        release = Event()
+
+        def encode_function(message):
+            release.wait(5)
+            return message
+
+        pipeline = SendPipeline(encode_function, lambda frames: None, depth=1)
+        pipeline.start()
+
+        # Message 0 blocks the encode stage, message 1 fills the pipeline.
+        pipeline.put(0)
+        while pipeline.statistics["waiting_encode"]:
+            time.sleep(0.001)
+        pipeline.put(1)
+
+        results = []
+        put_thread = Thread(target=lambda: results.append(pipeline.put(2)))
+        put_thread.start()
+        time.sleep(0.05)
+        self.assertTrue(put_thread.is_alive())
+
+        # The put waiting for space does not add its message after the pipeline stopped.
+        self.assertFalse(pipeline.stop(timeout=0.1))
+        put_thread.join(5)
+        self.assertListEqual(results, [False])
+
+        release.set()
+        self.assertTrue(pipeline.flush(timeout=5))
+        self.assertEqual(pipeline.n_sent, 0)
+        self.assertEqual(pipeline.n_dropped, 3)
+
+
+    def test_pipeline_overflow_policy(self):
+        for overflow_policy, expected_sent in [(DROP_NEWEST, [0, 1, 2]), (DROP_OLDEST, [0, 2, 3])]:
+            sent = []
+            release = Event()
+
+            def encode_function(message):
+                release.wait()
+                return message
+
+            pipeline = SendPipeline(encode_function, sent.append, depth=2, overflow_policy=overflow_policy)
+            pipeline.start()
+
+            # Message 0 blocks the encode stage.
+            pipeline.put(0)
+            while pipeline.statistics["waiting_encode"]:
+                time.sleep(0.001)
+
+            # Messages 1 and 2 fill the pipeline, 3 overflows.
+            self.assertTrue(pipeline.put(1))
+            self.assertTrue(pipeline.put(2))
+            self.assertEqual(pipeline.put(3), overflow_policy == DROP_OLDEST)
+
+            release.set()
+            self.assertTrue(pipeline.flush(timeout=5))
+            pipeline.stop()
+
+            self.assertListEqual(sent, expected_sent)
+            self.assertEqual(pipeline.n_received, 4)
+            self.assertEqual(pipeline.n_dropped, 1)
+            self.assertEqual(pipeline.n_sent, 3)
+
+            self.assertRaises(RuntimeError, pipeline.put, 4)
+
+        self.assertRaises(ValueError, SendPipeline, None, None, overflow_policy="invalid")
+        self.assertRaises(ValueError, Sender, overflow_policy="invalid")
+
+
+    def test_pacer(self):
+        class Clock:
+            # Simulated time - only advanced by sleeping and by the loop body.
+            def __init__(self):
+                self.now = 0.0
+
+            def __call__(self):
+                return self.now
+
+            def sleep(self, seconds):
+                self.now += seconds
+
+        # The time spent in the loop body does not reduce the rate.
+        clock = Clock()
+        pacer = Pacer(0.005, clock=clock, sleep=clock.sleep)
+        for _ in range(50):
+            pacer.wait()
+            clock.sleep(0.002)
+
+        statistics = pacer.statistics
+        self.assertEqual(statistics.n_iterations, 50)
+        self.assertEqual(statistics.n_skipped, 0)
+        self.assertAlmostEqual(statistics.rate, 200)
+        self.assertAlmostEqual(statistics.jitter_percentiles[100], 0)
+        self.assertEqual(set(statistics.jitter_percentiles), set(PacingStatistics.percentiles))
+
+        # Missed deadlines are sent back to back.
+        clock = Clock()
+        pacer = Pacer(0.01, clock=clock, sleep=clock.sleep)
+        for _ in range(10):
+            pacer.wait()
+            clock.sleep(0.015)
+
+        self.assertEqual(pacer.statistics.n_skipped, 0)
+        self.assertAlmostEqual(pacer.statistics.rate, 1 / 0.015)
+
+        # Missed deadlines are skipped - each iteration misses one.
+        clock = Clock()
+        pacer = Pacer(0.01, overrun_policy=SKIP, clock=clock, sleep=clock.sleep)
+        for _ in range(10):
+            pacer.wait()
+            clock.sleep(0.015)
+
+        self.assertEqual(pacer.statistics.n_skipped, 9)
+        self.assertAlmostEqual(pacer.statistics.rate, 50)
+
+        # Without an interval there is nothing to skip.
+        clock = Clock()
+        pacer = Pacer(0, overrun_policy=SKIP, clock=clock, sleep=clock.sleep)
+        for _ in range(10):
+            pacer.wait()
+            clock.sleep(0.001)
+
+        self.assertEqual(pacer.statistics.n_iterations, 10)
+        self.assertEqual(pacer.statistics.n_skipped, 0)
+        self.assertAlmostEqual(pacer.statistics.rate, 1000)
+
+        self.assertRaises(ValueError, Pacer, 0.01, overrun_policy="invalid")
+
+
+    def test_generate_stream_pacing(self):
+        send_stream = Sender(port=9998, mode=PUB)
+        send_stream.add_channel("slow", lambda pulse_id: time.sleep(0.002) or 1.0)
+
+        statistics = send_stream.generate_stream(n_messages=50, interval=0.005)
+        self.assertEqual(statistics.n_iterations, 50)
+        self.assertEqual(statistics.n_skipped, 0)
+
+        # Deadlines missed because of slow sends are skipped.
+        send_stream = Sender(port=9998, mode=PUB)
+        send_stream.add_channel("slow", lambda pulse_id: time.sleep(0.015) or 1.0)
+
+        statistics = send_stream.generate_stream(n_messages=10, interval=0.01, overrun_policy=SKIP)
+        self.assertEqual(statistics.n_iterations, 10)
+        self.assertGreater(statistics.n_skipped, 0)
+
+
+    def test_configuration_snapshot(self):
+        producing = Event()
+        release = Event()
+
+        def blocking_function(pulse_id):
+            producing.set()
+            release.wait(5)
+            return 1.0
+
+        with Source(host="localhost") as receive_stream:
+            with Sender() as send_stream:
+                send_stream.add_channel("blocking", blocking_function)
+                configuration = send_stream.configuration
+
+                send_thread = Thread(target=send_stream.send)
+                send_thread.start()
+                self.assertTrue(producing.wait(5))
+
+                # The send in progress does not block the reconfiguration.
+                start_time = time.time()
+                send_stream.add_channel("new", lambda pulse_id: 2.0)
+                self.assertLess(time.time() - start_time, 1)
+                self.assertFalse(release.is_set())
+
+                # The previous snapshot is not modified.
+                self.assertListEqual(list(configuration.channels), ["blocking"])
+                self.assertListEqual(list(send_stream.channels), ["blocking", "new"])
+                self.assertNotEqual(configuration.main_header["hash"], send_stream.main_header["hash"])
+
+                # Channels are only changed through the sender.
+                with self.assertRaises(TypeError):
+                    send_stream.channels["other"] = None
+
+                release.set()
+                send_thread.join()
+                send_stream.send()
+
+                message_1 = receive_stream.receive()
+                message_2 = receive_stream.receive()
+
+        # The send in progress used the configuration current at its start.
+        self.assertListEqual(list(message_1.data.data), ["blocking"])
+        self.assertListEqual(list(message_2.data.data), ["blocking", "new"])
+        self.assertEqual(message_2.data.data["new"].value, 2.0)
+
+
+    def test_check_data_concurrent_add_channel(self):
+        with Sender(mode=PUB) as send_stream:
+            send_stream.add_channel("one")
+            send_stream.send(1.0)
+            configuration = send_stream.configuration
+
+            # A channel added after the sending thread read the configuration is not lost.
+            send_stream.add_channel("two")
+            data_configuration = send_stream._get_data_configuration(configuration, [2, 3], None)
+
+            self.assertIs(data_configuration, send_stream.configuration)
+            self.assertListEqual(list(data_configuration.channels), ["one", "two"])
+            self.assertEqual(data_configuration.channels["two"].metadata["type"], "int64")
+
+            self.assertRaises(ValueError, send_stream._get_data_configuration, configuration, [2], None)
+
+
+    def test_concurrent_send_order(self):
+        n_threads = 4
+        n_messages = 25
+
+        with Source(host="localhost", receive_timeout=1000) as receive_stream:
+            with Sender() as send_stream:
+                send_stream.add_channel("one", lambda pulse_id: float(pulse_id))
+
+                def send():
+                    for _ in range(n_messages):
+                        send_stream.send()
+
+                threads = [Thread(target=send) for _ in range(n_threads)]
+                for thread in threads:
+                    thread.start()
+
+                pulse_ids = [receive_stream.receive().data.pulse_id for _ in range(n_threads * n_messages)]
+
+                for thread in threads:
+                    thread.join()
+
+        # Messages of concurrent sends leave in pulse id order.
+        self.assertListEqual(pulse_ids, list(range(n_threads * n_messages)))
+
+
+    def test_concurrent_send_functions(self):
+        n_threads = 3
+        # Only passes if the channel functions of the concurrent sends are called at the same time.
+        barrier = Barrier(n_threads)
+
+        def function(pulse_id):
+            barrier.wait(5)
+            # Later pulses are produced first.
+            time.sleep((n_threads - pulse_id) * 0.02)
+            if pulse_id == 1:
+                raise RuntimeError("Failed channel function")
+            return float(pulse_id)
+
+        errors = []
+
+        def send():
+            try:
+                send_stream.send()
+            except RuntimeError as e:
+                errors.append(e)
+
+        with Source(host="localhost", receive_timeout=1000) as receive_stream:
+            with Sender() as send_stream:
+                send_stream.add_channel("one", function)
+
+                threads = [Thread(target=send) for _ in range(n_threads)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                pulse_ids = [receive_stream.receive().data.pulse_id for _ in range(n_threads - 1)]
+
+        # The messages still leave in pulse id order - the failed send passes on its turn.
+        self.assertListEqual(pulse_ids, [0, 2])
+        self.assertEqual(len(errors), 1)
+
+
+    def test_function_executor(self):
+        n_functions = 4
+        # Only passes if all functions are called at the same time.
+        barrier = Barrier(n_functions)
+
+        def concurrent_function(pulse_id):
+            barrier.wait(5)
+            return float(pulse_id)
+
+        with ThreadPoolExecutor(n_functions) as executor:
+            with Source(host="localhost") as receive_stream:
+                with Sender(function_executor=executor, function_statistics=True) as send_stream:
+                    for index in range(n_functions):
+                        send_stream.add_channel(f"concurrent_{index}", concurrent_function)
+                    send_stream.add_channel("fast", lambda pulse_id: pulse_id * 2.0)
+
+                    send_stream.send(pulse_id=10)
+                    self.assertFalse(barrier.broken)
+
+                    message = receive_stream.receive()
+
+        self.assertEqual(message.data.data["concurrent_3"].value, 10.0)
+        self.assertEqual(message.data.data["fast"].value, 20.0)
+
+        statistics = send_stream.function_statistics
+        self.assertEqual(statistics.n_calls, 1)
+        self.assertListEqual(statistics.names, ["concurrent_0", "concurrent_1", "concurrent_2", "concurrent_3",
+                                                "fast"])
+        self.assertEqual(len(statistics.get_slowest(4)), 4)
+        self.assertTrue(np.all(statistics.max_time > 0))
+
+        # Statistics are only recorded if enabled.
+        with Sender(mode=PUB) as send_stream:
+            send_stream.add_channel("fast", lambda pulse_id: pulse_id * 2.0)
+            send_stream.send()
+            self.assertIsNone(send_stream.function_statistics)
+
+        # Process pools need picklable functions.
+        with ProcessPoolExecutor(2) as executor:
+            with Source(host="localhost") as receive_stream:
+                with Sender(function_executor=executor) as send_stream:
+                    send_stream.add_channel("process", float)
+                    send_stream.send(pulse_id=5)
+
+                    message = receive_stream.receive()
+
+        self.assertEqual(message.data.data["process"].value, 5.0)
+
+
+    def test_main_header_template(self):
+        with Sender(data_header_compression="bitshuffle_lz4") as send_stream:
+            send_stream.add_channel("x", lambda x: 1)
+
+            for backend in json_backend.available_backends:
+                json_backend.set_backend(backend)
+                main_header_template = _get_main_header_template(send_stream.main_header)
+
+                main_header = dict(send_stream.main_header, pulse_id=12345678901,
+                                   global_timestamp={"sec": 1700000000, "ns": 123456789})
+
+                # The template produces exactly the same bytes as encoding the full main header.
+                self.assertEqual(main_header_template % (12345678901, 1700000000, 123456789),
+                                 json_backend.dumps(main_header))
+
+            json_backend.set_backend(json_backend.default_backend)
+
+            # Values that are not exactly int are encoded as they are.
+            frames = send_stream._encode_message(True, 1700000000, 123456789, [1], None, None,
+                                                 send_stream.configuration)
+            self.assertIs(json_backend.loads(frames[0])["pulse_id"], True)
+
+        json_backend.set_backend(json_backend.default_backend)
+
+
+    def test_data_header_backend_independent(self):
+        for compression in [None, "bitshuffle_lz4"]:
+            data_headers = []
+
+            for backend in json_backend.available_backends:
+                json_backend.set_backend(backend)
+
+                with Sender(mode=PUB, data_header_compression=compression) as send_stream:
+                    send_stream.add_channel("x", metadata={"type": "float64", "shape": [2]})
+                    data_headers.append(bytes(send_stream.data_header_bytes))
+
+                    # Same bytes as encoding the data header with the standard library.
+                    self.assertEqual(send_stream.data_header_bytes,
+                                     get_value_bytes(json.dumps(send_stream.data_header), compression))
+
+            json_backend.set_backend(json_backend.default_backend)
+            self.assertEqual(len(set(data_headers)), 1)
+
+
+    def test_check_data_schema_stable(self):
+        with Source(host="localhost") as receive_stream:
+            with Sender() as send_stream:
+                send_stream.send(one=1, two=np.zeros(4, dtype=np.float32), three=[1, 2])
+                data_header_bytes = send_stream.data_header_bytes
+
+                # Same types and shapes - the data header is not rebuilt.
+                send_stream.send(one=2, two=np.ones(4, dtype=np.float32), three=[3, 4])
+                self.assertIs(send_stream.data_header_bytes, data_header_bytes)
+
+                # Changed shape - the data header is rebuilt.
+                send_stream.send(one=3, two=np.ones(5, dtype=np.float32), three=[5, 6])
+                self.assertIsNot(send_stream.data_header_bytes, data_header_bytes)
+                self.assertEqual(send_stream.channels["two"].metadata["shape"], [5])
+
+                # Changed byte order - the data header is rebuilt.
+                send_stream.send(one=4, two=np.ones(5, dtype=">f4"), three=[7, 8])
+                self.assertEqual(send_stream.channels["two"].metadata["encoding"], "big")
+
+                messages = [receive_stream.receive() for _ in range(4)]
+
+        for index, message in enumerate(messages):
+            self.assertEqual(message.data.data["one"].value, index + 1)
+            np.testing.assert_array_equal(message.data.data["three"].value, [2 * index + 1, 2 * index + 2])
+
+        np.testing.assert_array_equal(messages[1].data.data["two"].value, np.ones(4))
+        np.testing.assert_array_equal(messages[3].data.data["two"].value, np.ones(5))
+
+
+    def test_scalar_groups(self):
+        send_data = {"float_1": 1.5, "int_1": -2, "float32_1": np.float32(3.5), "int16_1": np.int16(-4),
+                     "array": np.arange(3, dtype=np.float64), "float_2": 5.5, "bool_1": True, "none": None,
+                     "string": "six", "float32_2": np.float32(7.5), "int_2": 8, "uint64_1": np.uint64(2 ** 63)}
+
+        with Source(host="localhost") as receive_stream:
+            with Sender() as send_stream:
+                send_stream.send(data=send_data)
+                message = receive_stream.receive()
+
+        self.assertEqual(len(receive_stream.handler.scalar_groups), 6)
+
+        for name, value in send_data.items():
+            received_value = message.data.data[name].value
+
+            if isinstance(value, np.ndarray):
+                np.testing.assert_array_equal(received_value, value)
+            else:
+                self.assertEqual(received_value, value)
+
+            if isinstance(value, np.generic):
+                self.assertEqual(received_value.dtype, value.dtype)
+
+
     def test_send_boolean(self):
         send_int_array = [[0, 1, 0, 1],
                           [1, 0, 1, 0]]